@@ -0,0 +1,374 @@
+"""Prometheus-format metrics for the API.
+
+MetricsMiddleware records per-route latency histograms and status counts,
+MongoCommandMetrics is a pymongo CommandListener timing every command per
+collection, MongoPoolMetrics follows connection pool usage per server, and
+REGISTRY.render() produces the text exposition served on /metrics. Everything is in-process with fixed buckets and a lock per metric,
+cheap enough to leave on in production.
+
+QueryBudgetMiddleware additionally counts the Mongo commands and Stripe calls
+each request makes, through a context variable, to surface N+1 patterns.
+"""
+import logging
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter as Tally
+from contextvars import ContextVar
+
+from pymongo import monitoring
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{value}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _number(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def set(self, labels, value):
+        with self._lock:
+            self._values[labels] = value
+
+    def inc(self, labels=(), amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def values(self):
+        with self._lock:
+            return dict(self._values)
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for labels, value in sorted(values.items()):
+            yield f"{self.name}{_labels(self.labelnames, labels)} {_number(value)}"
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self):
+        with self._lock:
+            series = {labels: (list(counts), total, n) for labels, (counts, total, n) in self._series.items()}
+        for labels, (counts, total, n) in sorted(series.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                yield f"{self.name}_bucket{_labels(self.labelnames, labels, [('le', _number(bound))])} {cumulative}"
+            yield f"{self.name}_sum{_labels(self.labelnames, labels)} {_number(total)}"
+            yield f"{self.name}_count{_labels(self.labelnames, labels)} {n}"
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.samples())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+http_request_duration = REGISTRY.histogram(
+    "http_request_duration_seconds", "HTTP request latency by route template", ("method", "route"))
+http_requests = REGISTRY.counter(
+    "http_requests_total", "HTTP responses by route template and status code", ("method", "route", "status"))
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing each request under its route template, e.g. /api/checkout/status/{session_id}"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            # Unmatched paths share one label so 404 scans cannot blow up cardinality
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            http_request_duration.observe((method, route), time.perf_counter() - started)
+            http_requests.inc((method, route, str(status)))
+
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Times every command sent through the client, labelled by collection and command name"""
+
+    def __init__(self, registry=REGISTRY):
+        self.duration = registry.histogram(
+            "mongodb_command_duration_seconds", "MongoDB command latency by collection", ("collection", "command"))
+        self.failures = registry.counter(
+            "mongodb_command_failures_total", "Failed MongoDB commands by collection", ("collection", "command"))
+        self._collections = {}
+
+    @staticmethod
+    def _collection(event):
+        target = event.command.get("collection" if event.command_name == "getMore" else event.command_name)
+        return target if isinstance(target, str) else ""
+
+    def started(self, event):
+        collection = self._collection(event)
+        self._collections[(event.connection_id, event.request_id)] = collection
+        record_mongo_command(collection, event.command_name)
+
+    def succeeded(self, event):
+        collection = self._collections.pop((event.connection_id, event.request_id), "")
+        self.duration.observe((collection, event.command_name), event.duration_micros / 1e6)
+
+    def failed(self, event):
+        labels = (self._collections.pop((event.connection_id, event.request_id), ""), event.command_name)
+        self.duration.observe(labels, event.duration_micros / 1e6)
+        self.failures.inc(labels)
+
+
+mongo_command_metrics = MongoCommandMetrics()
+
+
+class MongoPoolMetrics(monitoring.ConnectionPoolListener):
+    """Tracks open and checked-out connections, checkout waits and failures per server"""
+
+    def __init__(self, registry=REGISTRY):
+        self.open = registry.gauge(
+            "mongodb_pool_connections", "Open connections in the MongoDB pool", ("address",))
+        self.in_use = registry.gauge(
+            "mongodb_pool_connections_in_use", "MongoDB connections checked out by the app", ("address",))
+        self.waiting = registry.gauge(
+            "mongodb_pool_waiting", "Operations waiting to check out a MongoDB connection", ("address",))
+        self.created = registry.counter(
+            "mongodb_pool_connections_created_total", "MongoDB connections opened", ("address",))
+        self.checkout_failures = registry.counter(
+            "mongodb_pool_checkout_failures_total", "Failed MongoDB connection checkouts by reason", ("address", "reason"))
+        self.cleared = registry.counter(
+            "mongodb_pool_cleared_total", "MongoDB pool clears, e.g. after a network error", ("address",))
+
+    @staticmethod
+    def _address(event):
+        host, port = event.address
+        return f"{host}:{port}"
+
+    def snapshot(self):
+        """Current pool figures per server, for the admin endpoint"""
+        open_, in_use, waiting = self.open.values(), self.in_use.values(), self.waiting.values()
+        return {
+            address: {
+                "open": open_.get((address,), 0),
+                "in_use": in_use.get((address,), 0),
+                "waiting": waiting.get((address,), 0),
+            }
+            for address in sorted({labels[0] for labels in (*open_, *in_use, *waiting)})
+        }
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self.cleared.inc((self._address(event),))
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        address = self._address(event)
+        self.open.inc((address,))
+        self.created.inc((address,))
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self.open.inc((self._address(event),), -1)
+
+    def connection_check_out_started(self, event):
+        self.waiting.inc((self._address(event),))
+
+    def connection_check_out_failed(self, event):
+        address = self._address(event)
+        self.waiting.inc((address,), -1)
+        self.checkout_failures.inc((address, str(event.reason)))
+
+    def connection_checked_out(self, event):
+        address = self._address(event)
+        self.waiting.inc((address,), -1)
+        self.in_use.inc((address,))
+
+    def connection_checked_in(self, event):
+        self.in_use.inc((self._address(event),), -1)
+
+
+mongo_pool_metrics = MongoPoolMetrics()
+
+
+class QueryBudget:
+    """Commands issued on behalf of one request; list.append keeps it safe across Motor's threads"""
+
+    def __init__(self):
+        self.mongo_commands = []
+        self.stripe_calls = []
+
+    @property
+    def mongo(self):
+        return len(self.mongo_commands)
+
+    @property
+    def stripe(self):
+        return len(self.stripe_calls)
+
+    def summary(self):
+        return ", ".join(f"{collection}.{command}x{n}" for (collection, command), n in Tally(self.mongo_commands).most_common())
+
+
+# Motor copies the caller's context into its executor threads, so the listener
+# sees the budget of the request that issued each command
+current_query_budget = ContextVar("current_query_budget", default=None)
+
+
+def record_mongo_command(collection, command):
+    budget = current_query_budget.get()
+    if budget is not None:
+        budget.mongo_commands.append((collection, command))
+
+
+def record_stripe_call(operation):
+    budget = current_query_budget.get()
+    if budget is not None:
+        budget.stripe_calls.append(operation)
+
+
+class QueryBudgetMiddleware:
+    """Count Mongo commands and Stripe calls per request.
+
+    With expose_headers the counts go out as X-Mongo-Queries / X-Stripe-Calls
+    (read by the test suite to fail N+1 regressions); requests above
+    warn_threshold Mongo commands are logged with a per-collection breakdown.
+    """
+
+    def __init__(self, app, expose_headers=False, warn_threshold=50):
+        self.app = app
+        self.expose_headers = expose_headers
+        self.warn_threshold = warn_threshold
+        self.logger = logging.getLogger("query_budget")
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        budget = QueryBudget()
+        token = current_query_budget.set(budget)
+
+        async def send_with_counts(message):
+            if self.expose_headers and message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-mongo-queries", str(budget.mongo).encode()),
+                    (b"x-stripe-calls", str(budget.stripe).encode()),
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_counts)
+        finally:
+            current_query_budget.reset(token)
+            route = getattr(scope.get("route"), "path", None) or scope["path"]
+            if budget.mongo > self.warn_threshold:
+                self.logger.warning(
+                    f"{scope['method']} {route} issued {budget.mongo} Mongo commands "
+                    f"and {budget.stripe} Stripe calls: {budget.summary()}"
+                )
+            elif self.logger.isEnabledFor(logging.DEBUG):
+                self.logger.debug(f"{scope['method']} {route}: mongo={budget.mongo} stripe={budget.stripe}")
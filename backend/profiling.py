@@ -0,0 +1,110 @@
+"""Opt-in sampling profiler for live requests.
+
+Off unless PROFILING_ENABLED=1. A request is profiled when it carries
+`X-Profile: 1` together with admin credentials, or when it is picked at
+PROFILING_SAMPLE_RATE (0..1) among paths starting with one of
+PROFILING_PATHS. Profiles are taken with pyinstrument (an optional
+dependency, `pip install pyinstrument`) and written to PROFILING_DIR as
+speedscope JSON, next to a metadata file with the route, status and timing.
+One request is profiled at a time.
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+logger = logging.getLogger("profiling")
+
+
+class ProfilingMiddleware:
+    def __init__(self, app, output_dir, is_authorized, sample_rate=0.0, paths=(), interval=0.001):
+        self.app = app
+        self.output_dir = Path(output_dir)
+        self.is_authorized = is_authorized
+        self.sample_rate = sample_rate
+        self.paths = tuple(paths)
+        self.interval = interval
+        self._active = False
+        try:
+            from pyinstrument import Profiler
+            from pyinstrument.renderers import SpeedscopeRenderer
+        except ImportError:
+            logger.warning("PROFILING_ENABLED is set but pyinstrument is not installed; profiling disabled")
+            self._profiler_class = None
+        else:
+            self._profiler_class = Profiler
+            self._renderer_class = SpeedscopeRenderer
+
+    def _trigger(self, scope):
+        headers = dict(scope["headers"])
+        if headers.get(b"x-profile") == b"1":
+            return "header" if self.is_authorized(headers.get(b"authorization", b"").decode("latin-1")) else None
+        if self.sample_rate and scope["path"].startswith(self.paths) and random.random() < self.sample_rate:
+            return "sample"
+        return None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self._profiler_class is None or self._active:
+            await self.app(scope, receive, send)
+            return
+        trigger = self._trigger(scope)
+        if trigger is None:
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        self._active = True
+        profiler = self._profiler_class(interval=self.interval, async_mode="enabled")
+        started_at = datetime.now(timezone.utc)
+        started = time.perf_counter()
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            profiler.stop()
+            self._active = False
+            metadata = {
+                "method": scope["method"],
+                "path": scope["path"],
+                "route": getattr(scope.get("route"), "path", None),
+                "status": status,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                "started_at": started_at.isoformat(),
+                "trigger": trigger,
+            }
+            try:
+                await asyncio.to_thread(self._write, profiler, metadata)
+            except Exception as e:
+                logger.error(f"Error writing profile for {scope['path']}: {e}")
+
+    def _write(self, profiler, metadata):
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        route = (metadata["route"] or metadata["path"]).strip("/").replace("/", "_").replace("{", "").replace("}", "")
+        stem = f"{metadata['started_at'][:19].replace(':', '')}_{metadata['method']}_{route or 'root'}_{uuid.uuid4().hex[:6]}"
+        (self.output_dir / f"{stem}.speedscope.json").write_text(profiler.output(renderer=self._renderer_class()))
+        (self.output_dir / f"{stem}.json").write_text(json.dumps(metadata, indent=2))
+        logger.info(f"Saved profile {stem} ({metadata['duration_ms']}ms)")
+
+
+def profiling_settings():
+    """Read the PROFILING_* environment; returns None when profiling is off"""
+    if os.environ.get("PROFILING_ENABLED", "0") != "1":
+        return None
+    return {
+        "output_dir": os.environ.get("PROFILING_DIR", str(Path(__file__).parent / "profiles")),
+        "sample_rate": float(os.environ.get("PROFILING_SAMPLE_RATE", "0")),
+        "paths": tuple(p for p in os.environ.get("PROFILING_PATHS", "/api/").split(",") if p),
+        "interval": float(os.environ.get("PROFILING_INTERVAL", "0.001")),
+    }
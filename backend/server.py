@@ -1,16 +1,34 @@
-from fastapi import FastAPI, APIRouter, Request, HTTPException, Header
+from fastapi import FastAPI, APIRouter, Request, HTTPException, Header, Response, Query, Depends
 from dotenv import load_dotenv
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
 import os
+import json
+import asyncio
+import io
+import csv
+import sys
+import base64
+import argparse
+from collections import OrderedDict
+import hashlib
+import time
 import logging
+from contextlib import asynccontextmanager
 from pathlib import Path
 from pydantic import BaseModel, Field
-from typing import List, Optional, Dict
+from typing import Any, List, Optional, Dict
 import uuid
-from datetime import datetime, timezone
+import orjson
+from datetime import date, datetime, timezone, timedelta
 from enum import Enum
-from bson import ObjectId
+from bson import ObjectId, json_util
+from pymongo import IndexModel, ASCENDING, DESCENDING
+from pymongo.read_preferences import Primary, PrimaryPreferred, Secondary, SecondaryPreferred, Nearest
+from pymongo.errors import DuplicateKeyError, OperationFailure
+from profiling import ProfilingMiddleware, profiling_settings
+from metrics import REGISTRY, MetricsMiddleware, QueryBudgetMiddleware, mongo_command_metrics, mongo_pool_metrics, record_stripe_call
 from emergentintegrations.payments.stripe.checkout import StripeCheckout, CheckoutSessionResponse, CheckoutStatusResponse, CheckoutSessionRequest
 
 # Helper function to convert MongoDB ObjectId to string
@@ -32,16 +50,259 @@ def serialize_mongo_data(data):
     else:
         return data
 
+# orjson-backed response for Mongo documents: datetimes serialize natively and
+# returning it directly skips FastAPI's jsonable_encoder pass
+def orjson_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=orjson_default, option=orjson.OPT_NON_STR_KEYS)
+
+# In-process cache for a pre-rendered JSON body and its ETag.
+# Writers call invalidate() after changing the underlying collection; a rebuild
+# that raced with an invalidation is served once but never stored. Entries
+# also expire after ttl_seconds, which bounds how long other workers, whose
+# caches this process cannot invalidate, keep serving an old body.
+class VersionedResponseCache:
+    def __init__(self, loader, ttl_seconds: float):
+        self._loader = loader
+        self.ttl_seconds = ttl_seconds
+        self._version = 0
+        self._entry = None
+        self._lock = asyncio.Lock()
+
+    def invalidate(self):
+        self._version += 1
+        self._entry = None
+
+    def _fresh(self):
+        entry = self._entry
+        if entry is not None and entry[2] > time.monotonic():
+            return entry[:2]
+        return None
+
+    async def get(self):
+        """Return (body, etag), rebuilding through the loader at most once per version"""
+        entry = self._fresh()
+        if entry is not None:
+            return entry
+        async with self._lock:
+            entry = self._fresh()
+            if entry is not None:
+                return entry
+            version = self._version
+            content = await self._loader()
+            body = orjson.dumps(content, default=orjson_default, option=orjson.OPT_NON_STR_KEYS)
+            etag = f'"{hashlib.sha1(body).hexdigest()}"'
+            if version == self._version:
+                self._entry = (body, etag, time.monotonic() + self.ttl_seconds)
+            return body, etag
+
+# Coalesces concurrent calls for the same key into one in-flight task;
+# a cancelled waiter never cancels the shared call
+class SingleFlight:
+    def __init__(self):
+        self._inflight = {}
+
+    async def run(self, key, func):
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(func())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return await asyncio.shield(task)
+
+# Small in-process cache with a fixed time-to-live per entry
+class TTLCache:
+    def __init__(self, ttl_seconds: float, max_entries: int = 10000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._entries = {}
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            self._entries.pop(key, None)
+            return None
+        return value
+
+    def set(self, key, value):
+        self._entries.pop(key, None)
+        if len(self._entries) >= self.max_entries:
+            self._entries.pop(next(iter(self._entries)))
+        self._entries[key] = (value, time.monotonic() + self.ttl_seconds)
+
+    def pop(self, key):
+        self._entries.pop(key, None)
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    candidates = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in candidates or etag in candidates or f"W/{etag}" in candidates
+
+def cached_json_response(request: Request, body: bytes, etag: str) -> Response:
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
+# MongoDB connection: the client is created by connect_mongo() inside the
+# app lifespan (or by the CLI), with pool size, timeouts and read preference
+# taken from .env; unset values keep the driver defaults
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+MONGO_CLIENT_SETTINGS = {
+    "maxPoolSize": ("MONGO_MAX_POOL_SIZE", int),
+    "minPoolSize": ("MONGO_MIN_POOL_SIZE", int),
+    "maxIdleTimeMS": ("MONGO_MAX_IDLE_TIME_MS", int),
+    "waitQueueTimeoutMS": ("MONGO_WAIT_QUEUE_TIMEOUT_MS", int),
+    "connectTimeoutMS": ("MONGO_CONNECT_TIMEOUT_MS", int),
+    "socketTimeoutMS": ("MONGO_SOCKET_TIMEOUT_MS", int),
+    "serverSelectionTimeoutMS": ("MONGO_SERVER_SELECTION_TIMEOUT_MS", int),
+    "readPreference": ("MONGO_READ_PREFERENCE", str),
+}
+# Connections opened before the first request; defaults to minPoolSize
+MONGO_WARMUP_CONNECTIONS = int(os.environ.get("MONGO_WARMUP_CONNECTIONS", os.environ.get("MONGO_MIN_POOL_SIZE", "1")))
+
+client = None
+db = None
+
+def mongo_client_options():
+    options = {}
+    for option, (variable, parse) in MONGO_CLIENT_SETTINGS.items():
+        value = os.environ.get(variable)
+        if value:
+            options[option] = parse(value)
+    return options
+
+def connect_mongo():
+    global client, db
+    client = AsyncIOMotorClient(
+        mongo_url,
+        event_listeners=[mongo_command_metrics, mongo_pool_metrics],
+        **mongo_client_options()
+    )
+    db = client[os.environ['DB_NAME']]
+    return client
+
+def close_mongo():
+    global client
+    if client is not None:
+        client.close()
+        client = None
+
+async def warm_mongo_pool(connections: int):
+    """Select a server and open connections up front; concurrent pings each check out their own"""
+    await asyncio.gather(*(client.admin.command("ping") for _ in range(max(connections, 1))))
+
+# Per-route read routing: reporting reads (admin lists and exports) may be
+# served by a secondary within a staleness budget, keeping their scans off the
+# primary that takes checkout and booking writes. Checkout-critical reads are
+# pinned to the primary whatever MONGO_READ_PREFERENCE says
+REPORTING_READ_PREFERENCE = os.environ.get("REPORTING_READ_PREFERENCE", "secondaryPreferred")
+REPORTING_MAX_STALENESS_SECONDS = int(os.environ.get("REPORTING_MAX_STALENESS_SECONDS", "90"))  # server minimum is 90
+
+READ_PREFERENCE_MODES = {
+    "primaryPreferred": PrimaryPreferred,
+    "secondary": Secondary,
+    "secondaryPreferred": SecondaryPreferred,
+    "nearest": Nearest,
+}
+
+def build_read_preference(mode: str, max_staleness_seconds: int):
+    if mode == "primary":
+        return Primary()  # staleness does not apply to the primary
+    if mode not in READ_PREFERENCE_MODES:
+        raise ValueError(f"Unknown read preference: {mode}")
+    return READ_PREFERENCE_MODES[mode](max_staleness=max_staleness_seconds)
+
+READ_POLICIES = {
+    "primary": Primary(),
+    "reporting": build_read_preference(REPORTING_READ_PREFERENCE, REPORTING_MAX_STALENESS_SECONDS),
+}
+
+class RoutedDatabase:
+    """View of a database whose collections read with a fixed read preference"""
+
+    def __init__(self, database, read_preference):
+        self._database = database
+        self.read_preference = read_preference
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self._database.get_collection(name, read_preference=self.read_preference)
+
+    def __getitem__(self, name):
+        return self._database.get_collection(name, read_preference=self.read_preference)
+
+def routed_db(policy: str) -> RoutedDatabase:
+    return RoutedDatabase(db, READ_POLICIES[policy])
+
+def read_policy(policy: str):
+    """Dependency handing a route the database view for one of READ_POLICIES"""
+    async def dependency() -> RoutedDatabase:
+        return routed_db(policy)
+    return dependency
+
+# Startup stages run in registration order inside the app lifespan, so
+# one-off work such as seed migrations never runs on the request path
+startup_stages = []
+
+def startup_stage(name):
+    def register(func):
+        startup_stages.append((name, func))
+        return func
+    return register
+
+async def run_startup_stages():
+    """Run every registered stage and report how long each one took"""
+    started = time.perf_counter()
+    stages_ms = {}
+    results = {}
+    for name, stage in startup_stages:
+        stage_started = time.perf_counter()
+        result = await stage()
+        stages_ms[name] = round((time.perf_counter() - stage_started) * 1000, 2)
+        if result:
+            results[name] = result
+    report = {"stages_ms": stages_ms, "results": results, "total_ms": round((time.perf_counter() - started) * 1000, 2)}
+    logger.info(f"Startup completed in {report['total_ms']}ms: {stages_ms}")
+    return report
+
+@startup_stage("mongo_warmup")
+async def warm_mongo_pool_stage():
+    # An unreachable server only costs the first requests their latency, so
+    # do not keep the app from starting over it
+    try:
+        await warm_mongo_pool(MONGO_WARMUP_CONNECTIONS)
+    except Exception as e:
+        print(f"Error warming MongoDB pool: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    connect_mongo()
+    app.state.stripe_gateway = create_stripe_gateway()
+    app.state.startup_report = await run_startup_stages()
+    webhook_worker.start()
+    if RECONCILE_ENABLED:
+        reconciler.start(app.state.stripe_gateway)
+    yield
+    await reconciler.stop()
+    await webhook_worker.stop()
+    close_mongo()
 
 # Create the main app without a prefix
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 
 # Create a router with the /api prefix
 api_router = APIRouter(prefix="/api")
@@ -51,6 +312,62 @@ stripe_api_key = os.environ.get('STRIPE_API_KEY')
 if not stripe_api_key:
     raise ValueError("STRIPE_API_KEY not found in environment variables")
 
+STRIPE_CHECKOUT_BACKEND = os.environ.get("STRIPE_CHECKOUT_BACKEND", "stripe")  # stripe or stub
+STRIPE_TIMEOUT_SECONDS = float(os.environ.get("STRIPE_TIMEOUT_SECONDS", "20"))
+STRIPE_MAX_NETWORK_RETRIES = int(os.environ.get("STRIPE_MAX_NETWORK_RETRIES", "2"))
+STRIPE_MAX_CLIENTS = 16
+
+# One app-scoped gateway for all Stripe calls. Checkout clients are reused per
+# webhook_url (bounded LRU) instead of being built on every request
+class StripeGateway:
+    def __init__(self, factory):
+        self._factory = factory
+        self._clients = OrderedDict()
+
+    def checkout(self, webhook_url: str = ""):
+        stripe_checkout = self._clients.get(webhook_url)
+        if stripe_checkout is None:
+            stripe_checkout = self._factory(webhook_url)
+            self._clients[webhook_url] = stripe_checkout
+            if len(self._clients) > STRIPE_MAX_CLIENTS:
+                self._clients.popitem(last=False)
+        else:
+            self._clients.move_to_end(webhook_url)
+        return stripe_checkout
+
+    async def create_checkout_session(self, checkout_request, webhook_url: str):
+        record_stripe_call("create_checkout_session")
+        return await self.checkout(webhook_url).create_checkout_session(checkout_request)
+
+    async def get_checkout_status(self, session_id: str):
+        record_stripe_call("get_checkout_status")
+        return await self.checkout().get_checkout_status(session_id)
+
+    async def handle_webhook(self, body: bytes, signature: Optional[str]):
+        record_stripe_call("handle_webhook")
+        return await self.checkout().handle_webhook(body, signature)
+
+def configure_stripe_http_client():
+    """Give the Stripe SDK one keep-alive session with our timeouts and retries"""
+    try:
+        import stripe
+    except ImportError:
+        return
+    requests_client = getattr(stripe, "RequestsClient", None) or stripe.http_client.RequestsClient
+    stripe.default_http_client = requests_client(timeout=STRIPE_TIMEOUT_SECONDS)
+    stripe.max_network_retries = STRIPE_MAX_NETWORK_RETRIES
+
+def create_stripe_gateway() -> StripeGateway:
+    if STRIPE_CHECKOUT_BACKEND == "stub":
+        from stripe_stub import StubStripeCheckout
+        stub = StubStripeCheckout()
+        return StripeGateway(lambda webhook_url: stub)
+    configure_stripe_http_client()
+    return StripeGateway(lambda webhook_url: StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url))
+
+async def get_stripe_gateway(request: Request) -> StripeGateway:
+    return request.app.state.stripe_gateway
+
 # Legacy services for migration - will be moved to database
 LEGACY_SERVICES = {
     "amor": {
@@ -91,6 +408,9 @@ LEGACY_SERVICES = {
     }
 }
 
+# Consulta statuses that hold their slot
+ACTIVE_CONSULTA_STATUSES = ["agendado", "confirmado"]
+
 # Define Models
 class PaymentStatus(str, Enum):
     INITIATED = "initiated"
@@ -99,6 +419,20 @@ class PaymentStatus(str, Enum):
     FAILED = "failed"
     EXPIRED = "expired"
 
+# Allowed payment status moves; every write to payment_status filters on the
+# statuses that may reach its target, so repeats and regressions match nothing
+PAYMENT_STATUS_TRANSITIONS = {
+    PaymentStatus.INITIATED: {PaymentStatus.PENDING, PaymentStatus.COMPLETED, PaymentStatus.EXPIRED, PaymentStatus.FAILED},
+    PaymentStatus.PENDING: {PaymentStatus.COMPLETED, PaymentStatus.EXPIRED, PaymentStatus.FAILED},
+    PaymentStatus.COMPLETED: set(),
+    PaymentStatus.EXPIRED: set(),
+    PaymentStatus.FAILED: set(),
+}
+
+# Statuses a transaction never leaves once reached
+TERMINAL_PAYMENT_STATUSES = {status for status, targets in PAYMENT_STATUS_TRANSITIONS.items() if not targets}
+OPEN_PAYMENT_STATUSES = [status for status, targets in PAYMENT_STATUS_TRANSITIONS.items() if targets]
+
 class ServiceType(str, Enum):
     AMOR = "amor"
     PROTECAO = "protecao"
@@ -137,6 +471,8 @@ class PaymentTransaction(BaseModel):
     currency: str = "brl"
     payment_status: PaymentStatus
     metadata: Optional[Dict] = None
+    reconcile_after: Optional[datetime] = None  # when the reconciler should next ask Stripe
+    status_timestamps: Dict[str, datetime] = Field(default_factory=dict)  # when each status was reached
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -161,6 +497,7 @@ class ConsultaAgendamento(BaseModel):
     horario: str
     valor: float = 50.00
     status: str = "agendado"  # agendado, confirmado, realizado, cancelado
+    ocupa_horario: bool = True  # True while status holds the slot (agendado, confirmado)
     observacoes: Optional[str] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -221,164 +558,986 @@ class RitualUpdate(BaseModel):
 async def root():
     return {"message": "Mystic Services API"}
 
+# Index registry: every index the server relies on, ensured at startup.
+# The unique ones back the id/session_id lookups and keep them unambiguous
+INDEXES = {
+    "rituais": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("active", ASCENDING)], name="active"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+    ],
+    "payment_transactions": [
+        IndexModel([("session_id", ASCENDING)], name="session_id_unique", unique=True),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+        IndexModel([("payment_status", ASCENDING), ("reconcile_after", ASCENDING)], name="status_reconcile_after"),
+        IndexModel([("completed_at", ASCENDING)], name="revenue_unbooked",
+                   partialFilterExpression={"revenue_booked": False}),
+    ],
+    "checkout_idempotency": [
+        IndexModel([("expires_at", ASCENDING)], name="expires_at_ttl", expireAfterSeconds=0),
+    ],
+    "client_forms": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("payment_session_id", ASCENDING)], name="payment_session_id"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+    ],
+    "consultas": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("data_consulta", ASCENDING), ("horario", ASCENDING), ("status", ASCENDING)], name="slot_status"),
+        IndexModel([("data_consulta", ASCENDING), ("horario", ASCENDING), ("id", ASCENDING)], name="slot_id"),
+        # One active booking per slot; enforced by the server instead of a read-then-insert
+        IndexModel(
+            [("data_consulta", ASCENDING), ("horario", ASCENDING)],
+            name="slot_unique_active",
+            unique=True,
+            partialFilterExpression={"ocupa_horario": True}
+        ),
+    ],
+    "webhook_inbox": [
+        IndexModel([("status", ASCENDING), ("received_at", ASCENDING)], name="status_received_at"),
+        IndexModel([("lock_token", ASCENDING)], name="lock_token", sparse=True),
+        # Processed events are kept well past Stripe's 3-day retry window for dedupe
+        IndexModel([("processed_at", ASCENDING)], name="processed_at_ttl", expireAfterSeconds=30 * 24 * 3600),
+    ],
+    "revenue_rollups": [
+        IndexModel([("day", ASCENDING), ("service_type", ASCENDING)], name="day_service_type"),
+    ],
+    "flyers": [
+        IndexModel([("id", ASCENDING)], name="id_unique", unique=True),
+        IndexModel([("ativo", ASCENDING), ("created_at", DESCENDING)], name="ativo_created_at"),
+        IndexModel([("created_at", DESCENDING), ("id", DESCENDING)], name="created_at_id"),
+    ],
+}
+
+# Last build error per (collection, index name), shown by index_report
+index_build_failures = {}
+
+async def ensure_indexes():
+    """Create any missing registry index, one at a time so a failing build (say
+    a unique index over duplicate data) does not take the others down; returns
+    the failures, which are also logged"""
+    failures = []
+    for collection_name, models in INDEXES.items():
+        for model in models:
+            key = (collection_name, model.document["name"])
+            try:
+                await db[collection_name].create_indexes([model])
+                index_build_failures.pop(key, None)
+            except OperationFailure as e:
+                logger.error(f"Error creating index {collection_name}.{model.document['name']}: {e}")
+                index_build_failures[key] = str(e)
+                failures.append({"collection": collection_name, "name": model.document["name"], "error": str(e)})
+    return failures
+
+async def index_report():
+    """List registry indexes as present/missing, plus unregistered extras, with sizes in bytes"""
+    report = []
+    for collection_name, models in INDEXES.items():
+        collection = db[collection_name]
+        existing = await collection.index_information()
+        sizes = {}
+        try:
+            async for stats in collection.aggregate([{"$collStats": {"storageStats": {}}}]):
+                sizes.update(stats.get("storageStats", {}).get("indexSizes", {}))
+        except OperationFailure:
+            pass
+        
+        expected_names = set()
+        for model in models:
+            spec = model.document
+            expected_names.add(spec["name"])
+            build_error = index_build_failures.get((collection_name, spec["name"]))
+            if spec["name"] in existing:
+                status = "present"
+            else:
+                status = "failed" if build_error else "missing"
+            report.append({
+                "collection": collection_name,
+                "name": spec["name"],
+                "keys": list(spec["key"].items()),
+                "unique": spec.get("unique", False),
+                "status": status,
+                "size_bytes": sizes.get(spec["name"]),
+                "error": build_error if status == "failed" else None
+            })
+        for name, info in existing.items():
+            if name != "_id_" and name not in expected_names:
+                report.append({
+                    "collection": collection_name,
+                    "name": name,
+                    "keys": info["key"],
+                    "unique": info.get("unique", False),
+                    "status": "extra",
+                    "size_bytes": sizes.get(name),
+                    "error": None
+                })
+    return report
+
+# Data migrations run once across all workers: a marker document records
+# completion and a lock document keeps concurrent workers from racing. The
+# lock carries its holder's token, so a holder that overran the timeout
+# cannot release the lock of the worker that took it over
+MIGRATION_LOCK_TIMEOUT = timedelta(minutes=5)
+MIGRATION_WAIT_SECONDS = 30
+MIGRATION_POLL_SECONDS = 0.5
+
+async def run_migration_once(name, migration):
+    """Run migration unless its marker exists; returns True if this call ran it"""
+    if await db.migrations.find_one({"_id": name, "status": "done"}):
+        return False
+    
+    lock_id = f"{name}:lock"
+    owner = str(uuid.uuid4())
+    now = datetime.now(timezone.utc)
+    try:
+        await db.migrations.insert_one({"_id": lock_id, "owner": owner, "locked_at": now})
+    except DuplicateKeyError:
+        # Take over the lock only if its holder died mid-migration
+        stale = await db.migrations.find_one_and_update(
+            {"_id": lock_id, "locked_at": {"$lt": now - MIGRATION_LOCK_TIMEOUT}},
+            {"$set": {"owner": owner, "locked_at": now}}
+        )
+        if not stale:
+            deadline = time.monotonic() + MIGRATION_WAIT_SECONDS
+            while time.monotonic() < deadline:
+                if await db.migrations.find_one({"_id": name, "status": "done"}):
+                    break
+                await asyncio.sleep(MIGRATION_POLL_SECONDS)
+            return False
+    
+    try:
+        if await db.migrations.find_one({"_id": name, "status": "done"}):
+            return False
+        await migration()
+        await db.migrations.update_one(
+            {"_id": name},
+            {"$set": {"status": "done", "completed_at": datetime.now(timezone.utc)}},
+            upsert=True
+        )
+        return True
+    finally:
+        await db.migrations.delete_one({"_id": lock_id, "owner": owner})
+
 # Helper function to migrate legacy services to database
 async def migrate_legacy_services():
     """Migrate legacy services to database if no services exist"""
+    count = await db.rituais.count_documents({})
+    if count == 0:
+        print("Migrating legacy services to database...")
+        for service_key, service_data in LEGACY_SERVICES.items():
+            ritual = Ritual(
+                id=service_key,
+                name=service_data["name"],
+                description=service_data["description"],
+                price=service_data["price"],
+                duration=service_data["duration"],
+                image=service_data["image"],
+                category=service_data["category"],
+                active=service_data["active"]
+            )
+            # Upsert by id so a retried migration never duplicates the seed
+            await db.rituais.update_one(
+                {"id": ritual.id},
+                {"$setOnInsert": ritual.dict()},
+                upsert=True
+            )
+        print("Legacy services migrated successfully!")
+
+@startup_stage("legacy_services_migration")
+async def migrate_legacy_services_stage():
     try:
-        count = await db.rituais.count_documents({})
-        if count == 0:
-            print("Migrating legacy services to database...")
-            for service_key, service_data in LEGACY_SERVICES.items():
-                ritual = Ritual(
-                    id=service_key,
-                    name=service_data["name"],
-                    description=service_data["description"],
-                    price=service_data["price"],
-                    duration=service_data["duration"],
-                    image=service_data["image"],
-                    category=service_data["category"],
-                    active=service_data["active"]
-                )
-                await db.rituais.insert_one(ritual.dict())
-            print("Legacy services migrated successfully!")
+        await run_migration_once("legacy_services_seed", migrate_legacy_services)
     except Exception as e:
         print(f"Error migrating legacy services: {e}")
 
+# Helper function to remove rituais duplicated by the old seed race before the
+# unique id index is built; the first copy inserted is the one reads and
+# updates by id have been hitting, so it is the one kept
+async def dedupe_rituais():
+    duplicates = db.rituais.aggregate([
+        {"$sort": {"_id": 1}},
+        {"$group": {"_id": "$id", "copies": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ])
+    extra_ids = []
+    async for duplicate in duplicates:
+        extra_ids.extend(duplicate["copies"][1:])
+    if extra_ids:
+        await db.rituais.delete_many({"_id": {"$in": extra_ids}})
+        logger.warning(f"Removed {len(extra_ids)} duplicate rituais")
+
+@startup_stage("rituais_dedupe")
+async def dedupe_rituais_stage():
+    try:
+        await run_migration_once("rituais_dedupe", dedupe_rituais)
+    except Exception as e:
+        print(f"Error removing duplicate rituais: {e}")
+
+# Helper function to flag existing consultas for the unique active-slot index
+async def backfill_consulta_slots():
+    await db.consultas.update_many(
+        {"ocupa_horario": {"$exists": False}, "status": {"$in": ACTIVE_CONSULTA_STATUSES}},
+        {"$set": {"ocupa_horario": True}}
+    )
+    await db.consultas.update_many(
+        {"ocupa_horario": {"$exists": False}},
+        {"$set": {"ocupa_horario": False}}
+    )
+
+@startup_stage("consulta_slots_backfill")
+async def backfill_consulta_slots_stage():
+    try:
+        await run_migration_once("consultas_ocupa_horario", backfill_consulta_slots)
+    except Exception as e:
+        print(f"Error backfilling consulta slots: {e}")
+
+# Helper function to settle slots double-booked before the unique index
+# existed: the oldest active booking keeps the slot, later ones stay booked
+# but stop holding it and are logged so the admin can reschedule them
+async def release_duplicate_slots():
+    duplicates = db.consultas.aggregate([
+        {"$match": {"ocupa_horario": True}},
+        {"$sort": {"created_at": 1, "_id": 1}},
+        {"$group": {
+            "_id": {"data_consulta": "$data_consulta", "horario": "$horario"},
+            "consultas": {"$push": "$id"},
+            "count": {"$sum": 1}
+        }},
+        {"$match": {"count": {"$gt": 1}}}
+    ])
+    released = []
+    async for duplicate in duplicates:
+        released.extend(duplicate["consultas"][1:])
+        logger.warning(
+            f"Slot {duplicate['_id']['data_consulta']} {duplicate['_id']['horario']} was double-booked: "
+            f"kept {duplicate['consultas'][0]}, released {duplicate['consultas'][1:]}"
+        )
+    if released:
+        await db.consultas.update_many({"id": {"$in": released}}, {"$set": {"ocupa_horario": False}})
+
+@startup_stage("consulta_slot_duplicates")
+async def release_duplicate_slots_stage():
+    try:
+        await run_migration_once("consultas_slot_duplicates", release_duplicate_slots)
+    except Exception as e:
+        print(f"Error releasing double-booked slots: {e}")
+
+# Helper function to schedule reconciliation of transactions created before it existed
+async def backfill_reconcile_after():
+    await db.payment_transactions.update_many(
+        {"payment_status": {"$in": OPEN_PAYMENT_STATUSES}, "reconcile_after": {"$exists": False}},
+        [{"$set": {"reconcile_after": "$updated_at"}}]
+    )
+
+@startup_stage("transactions_reconcile_backfill")
+async def backfill_reconcile_after_stage():
+    try:
+        await run_migration_once("transactions_reconcile_after", backfill_reconcile_after)
+    except Exception as e:
+        print(f"Error backfilling reconcile_after: {e}")
+
+# Indexes come after the backfills so partial indexes see migrated documents
+# Indexes the write paths rely on for correctness rather than speed; the app
+# refuses to start without them
+GUARD_INDEXES = [("consultas", "slot_unique_active")]
+
+@startup_stage("ensure_indexes")
+async def ensure_indexes_stage():
+    failures = await ensure_indexes()
+    for collection_name, name in GUARD_INDEXES:
+        if name not in await db[collection_name].index_information():
+            raise RuntimeError(
+                f"Required index {collection_name}.{name} is missing: "
+                f"{index_build_failures.get((collection_name, name), 'not built')}"
+            )
+    return {"failed": failures} if failures else None
+
+async def load_services_catalog():
+    # Get active rituals from database
+    rituais = await db.rituais.find({"active": True}).to_list(1000)
+    
+    # Convert to legacy format for compatibility
+    services = {}
+    for ritual in rituais:
+        services[ritual["id"]] = {
+            "name": ritual["name"],
+            "description": ritual["description"],
+            "price": ritual["price"],
+            "duration": ritual["duration"],
+            "image": ritual["image"],
+            "category": ritual["category"]
+        }
+    
+    return {"services": services}
+
+# Storefront catalog, rebuilt after this worker creates, updates or deletes a
+# ritual and at least every SERVICES_CACHE_TTL_SECONDS for edits made elsewhere
+SERVICES_CACHE_TTL_SECONDS = float(os.environ.get("SERVICES_CACHE_TTL_SECONDS", "30"))
+
+services_cache = VersionedResponseCache(load_services_catalog, SERVICES_CACHE_TTL_SECONDS)
+
 @api_router.get("/services")
-async def get_services():
+async def get_services(request: Request):
     try:
-        # Ensure legacy services are migrated
-        await migrate_legacy_services()
-        
-        # Get active rituals from database
-        rituais = await db.rituais.find({"active": True}).to_list(1000)
-        
-        # Convert to legacy format for compatibility
-        services = {}
-        for ritual in rituais:
-            services[ritual["id"]] = {
-                "name": ritual["name"],
-                "description": ritual["description"],
-                "price": ritual["price"],
-                "duration": ritual["duration"],
-                "image": ritual["image"],
-                "category": ritual["category"]
-            }
-        
-        return {"services": services}
+        body, etag = await services_cache.get()
+        return cached_json_response(request, body, etag)
     except Exception as e:
         # Fallback to legacy services
         print(f"Error loading services from database: {e}")
         return {"services": LEGACY_SERVICES}
 
-@api_router.post("/checkout/session")
-async def create_checkout_session(request: CheckoutRequest):
-    try:
-        # Get ritual from database
-        ritual = await db.rituais.find_one({"id": request.service_type, "active": True})
-        if not ritual:
-            # Fallback to legacy services
-            if request.service_type not in LEGACY_SERVICES:
-                raise HTTPException(status_code=400, detail="Serviço inválido")
-            service = LEGACY_SERVICES[request.service_type]
-            amount = service["price"]
-            service_name = service["name"]
-        else:
-            amount = ritual["price"]
-            service_name = ritual["name"]
-        
-        # Create success and cancel URLs
-        success_url = f"{request.origin_url}/success?session_id={{CHECKOUT_SESSION_ID}}"
-        cancel_url = f"{request.origin_url}/cancel"
-        
-        # Initialize Stripe checkout
-        webhook_url = f"{request.origin_url}/api/webhook/stripe"
-        stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url=webhook_url)
-        
-        # Create checkout session
-        checkout_request = CheckoutSessionRequest(
-            amount=amount,
-            currency="brl",
-            success_url=success_url,
-            cancel_url=cancel_url,
-            metadata={
-                "service_type": request.service_type,
-                "service_name": service_name
-            }
-        )
-        
-        session = await stripe_checkout.create_checkout_session(checkout_request)
+async def start_checkout(request: CheckoutRequest, stripe_gateway: StripeGateway):
+    """Create the Stripe session and its INITIATED transaction"""
+    # Get ritual from database
+    ritual = await db.rituais.find_one({"id": request.service_type, "active": True})
+    if not ritual:
+        # Fallback to legacy services
+        if request.service_type not in LEGACY_SERVICES:
+            raise HTTPException(status_code=400, detail="Serviço inválido")
+        service = LEGACY_SERVICES[request.service_type]
+        amount = service["price"]
+        service_name = service["name"]
+    else:
+        amount = ritual["price"]
+        service_name = ritual["name"]
+    
+    # Create success and cancel URLs
+    success_url = f"{request.origin_url}/success?session_id={{CHECKOUT_SESSION_ID}}"
+    cancel_url = f"{request.origin_url}/cancel"
+    
+    webhook_url = f"{request.origin_url}/api/webhook/stripe"
+    
+    # Create checkout session
+    checkout_request = CheckoutSessionRequest(
+        amount=amount,
+        currency="brl",
+        success_url=success_url,
+        cancel_url=cancel_url,
+        metadata={
+            "service_type": request.service_type,
+            "service_name": service_name
+        }
+    )
+    
+    session = await stripe_gateway.create_checkout_session(checkout_request, webhook_url)
+    
+    # Create payment transaction record
+    now = datetime.now(timezone.utc)
+    transaction = PaymentTransaction(
+        session_id=session.session_id,
+        service_type=request.service_type,
+        amount=amount,
+        payment_status=PaymentStatus.INITIATED,
+        metadata=checkout_request.metadata,
+        reconcile_after=now + timedelta(seconds=RECONCILE_STALE_SECONDS),
+        status_timestamps={PaymentStatus.INITIATED.value: now},
+        created_at=now,
+        updated_at=now
+    )
+    
+    await db.payment_transactions.insert_one(transaction.dict())
+    
+    return {"url": session.url, "session_id": session.session_id}
+
+# Checkout idempotency: a repeat of the same checkout request within the
+# window gets the session already created instead of a new Stripe session.
+# Clients send an Idempotency-Key header (kept for a day); deriving a key from
+# the caller and the body for keyless requests is opt-in through
+# CHECKOUT_DERIVED_KEY_SECONDS, since callers behind one NAT share it.
+# Keys live in checkout_idempotency as a pending placeholder while the first
+# request talks to Stripe; in-process duplicates share its task and duplicates
+# on other workers wait for the placeholder to be filled in. The placeholder
+# only holds a short lease that its owner renews while Stripe is slow, so one
+# left behind by a crashed worker is taken over once it runs out instead of
+# blocking the key for its whole window. Waiters give up only after the
+# longest a Stripe call can take with its retries
+CHECKOUT_IDEMPOTENCY_TTL_SECONDS = float(os.environ.get("CHECKOUT_IDEMPOTENCY_TTL_SECONDS", "86400"))
+CHECKOUT_DERIVED_KEY_SECONDS = float(os.environ.get("CHECKOUT_DERIVED_KEY_SECONDS", "0"))
+CHECKOUT_IDEMPOTENCY_LEASE_SECONDS = 30
+CHECKOUT_IDEMPOTENCY_WAIT_SECONDS = STRIPE_TIMEOUT_SECONDS * (STRIPE_MAX_NETWORK_RETRIES + 1) + 5
+CHECKOUT_IDEMPOTENCY_POLL_SECONDS = 0.1
+
+checkout_creation_flight = SingleFlight()
+
+def checkout_idempotency_key(checkout_request: CheckoutRequest, request: Request, idempotency_key: Optional[str]):
+    """Return (key, fingerprint, ttl_seconds), or None when the request is not deduplicated"""
+    fingerprint = hashlib.sha256(f"{checkout_request.service_type}\n{checkout_request.origin_url}".encode()).hexdigest()
+    if idempotency_key:
+        return f"key:{hashlib.sha256(idempotency_key.encode()).hexdigest()}", fingerprint, CHECKOUT_IDEMPOTENCY_TTL_SECONDS
+    if CHECKOUT_DERIVED_KEY_SECONDS <= 0:
+        return None
+    forwarded_for = request.headers.get("x-forwarded-for")
+    caller = forwarded_for.split(",")[0].strip() if forwarded_for else (request.client.host if request.client else "")
+    material = f"{caller}\n{request.headers.get('user-agent', '')}\n{fingerprint}"
+    return f"derived:{hashlib.sha256(material.encode()).hexdigest()}", fingerprint, CHECKOUT_DERIVED_KEY_SECONDS
+
+async def claim_checkout_key(key: str, fingerprint: str):
+    """Insert the pending placeholder for key; returns ("done", response) if
+    an earlier request already created the session, or ("claimed", claim_id)"""
+    deadline = time.monotonic() + CHECKOUT_IDEMPOTENCY_WAIT_SECONDS
+    while True:
+        now = datetime.now(timezone.utc)
+        claim_id = str(uuid.uuid4())
+        try:
+            await db.checkout_idempotency.insert_one({
+                "_id": key,
+                "fingerprint": fingerprint,
+                "status": "pending",
+                "claim_id": claim_id,
+                "created_at": now,
+                "expires_at": now + timedelta(seconds=CHECKOUT_IDEMPOTENCY_LEASE_SECONDS)
+            })
+            return "claimed", claim_id
+        except DuplicateKeyError:
+            pass
         
-        # Create payment transaction record
-        transaction = PaymentTransaction(
-            session_id=session.session_id,
-            service_type=request.service_type,
-            amount=amount,
-            payment_status=PaymentStatus.INITIATED,
-            metadata=checkout_request.metadata
+        existing = await routed_db("primary").checkout_idempotency.find_one({"_id": key})
+        if existing is None:
+            continue
+        if existing["expires_at"].replace(tzinfo=timezone.utc) <= now:
+            # A finished key past its window, or a pending lease whose owner
+            # died; the TTL monitor may not have removed it yet
+            await db.checkout_idempotency.delete_one({"_id": key, "expires_at": existing["expires_at"]})
+            continue
+        if existing["fingerprint"] != fingerprint:
+            raise HTTPException(status_code=409, detail="Chave de idempotência já usada com outros dados")
+        if existing["status"] == "done":
+            return "done", existing["response"]
+        if time.monotonic() >= deadline:
+            raise HTTPException(status_code=409, detail="Sessão de pagamento ainda em criação, tente novamente")
+        await asyncio.sleep(CHECKOUT_IDEMPOTENCY_POLL_SECONDS)
+
+async def renew_checkout_lease(claim: Dict):
+    """Keep pushing the placeholder's lease forward until cancelled"""
+    while True:
+        await asyncio.sleep(CHECKOUT_IDEMPOTENCY_LEASE_SECONDS / 3)
+        try:
+            await db.checkout_idempotency.update_one(
+                claim,
+                {"$set": {"expires_at": datetime.now(timezone.utc) + timedelta(seconds=CHECKOUT_IDEMPOTENCY_LEASE_SECONDS)}}
+            )
+        except Exception as e:
+            logger.error(f"Error renewing checkout idempotency lease: {e}")
+
+async def create_checkout_once(key: str, fingerprint: str, ttl_seconds: float, checkout_request: CheckoutRequest, stripe_gateway: StripeGateway):
+    outcome, value = await claim_checkout_key(key, fingerprint)
+    if outcome == "done":
+        return value
+    claim = {"_id": key, "status": "pending", "claim_id": value}
+    renewal = asyncio.create_task(renew_checkout_lease(claim))
+    try:
+        response = await start_checkout(checkout_request, stripe_gateway)
+    except BaseException:
+        # Let a retry with the same key try again rather than wait on us
+        await db.checkout_idempotency.delete_one(claim)
+        raise
+    finally:
+        renewal.cancel()
+    # Only now does the key get its full window; if our lease ran out and
+    # another request took the key over, its placeholder is left alone
+    await db.checkout_idempotency.update_one(
+        claim,
+        {"$set": {
+            "status": "done",
+            "response": response,
+            "expires_at": datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)
+        }}
+    )
+    return response
+
+@api_router.post("/checkout/session")
+async def create_checkout_session(
+    checkout_request: CheckoutRequest,
+    request: Request,
+    stripe_gateway: StripeGateway = Depends(get_stripe_gateway),
+    idempotency_key: Optional[str] = Header(None)
+):
+    try:
+        idempotency = checkout_idempotency_key(checkout_request, request, idempotency_key)
+        if idempotency is None:
+            return await start_checkout(checkout_request, stripe_gateway)
+        key, fingerprint, ttl_seconds = idempotency
+        return await checkout_creation_flight.run(
+            (key, fingerprint),
+            lambda: create_checkout_once(key, fingerprint, ttl_seconds, checkout_request, stripe_gateway)
         )
         
-        await db.payment_transactions.insert_one(transaction.dict())
-        
-        return {"url": session.url, "session_id": session.session_id}
-        
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao criar sessão de pagamento: {str(e)}")
 
+# Checkout status polling: concurrent polls for a session share one Stripe
+# call, pending answers are reused for a short TTL and terminal transactions
+# are answered from Mongo without calling Stripe at all
+CHECKOUT_STATUS_TTL_SECONDS = float(os.environ.get("CHECKOUT_STATUS_TTL_SECONDS", "2"))
+
+checkout_status_flight = SingleFlight()
+checkout_status_cache = TTLCache(CHECKOUT_STATUS_TTL_SECONDS)
+
+# Revenue rollups: one document per (UTC day, service_type), incremented by
+# whichever call actually flips a transaction to COMPLETED
+# Standalone servers have no multi-document transactions, so the COMPLETED
+# flip and the rollup increment are two writes: the flip sets revenue_booked
+# False, the increment is idempotent per session (the rollup lists the
+# sessions it counted) and sets it True, and the reconciler re-books any
+# completed transaction left unbooked by a crash in between
+async def record_revenue(session_id: str, service_type: str, amount: float, completed_at: datetime):
+    day = completed_at.date().isoformat()
+    uncounted = {"_id": f"{day}:{service_type}", "sessions": {"$ne": session_id}}
+    increment = {
+        "$inc": {"count": 1, "amount": amount},
+        "$push": {"sessions": session_id},
+        "$setOnInsert": {"day": day, "service_type": service_type}
+    }
+    try:
+        await db.revenue_rollups.update_one(uncounted, increment, upsert=True)
+    except DuplicateKeyError:
+        # Either the rollup already counts this session, or another session's
+        # upsert created it first; the server does not retry upserts whose
+        # filter is not all equality matches, so retry as a plain update,
+        # which matches nothing only in the first case
+        await db.revenue_rollups.update_one(uncounted, increment)
+    await db.payment_transactions.update_one({"session_id": session_id}, {"$set": {"revenue_booked": True}})
+
+async def transition_transaction(session_id: str, target: PaymentStatus, extra_fields: Optional[Dict] = None,
+                                 projection: Optional[Dict] = None, now: Optional[datetime] = None):
+    """Move a transaction to target if PAYMENT_STATUS_TRANSITIONS allows it from
+    its current status; returns the document as it was before the move, or
+    None when the transaction was not in a status that may reach target"""
+    now = now or datetime.now(timezone.utc)
+    sources = [status for status, targets in PAYMENT_STATUS_TRANSITIONS.items() if target in targets]
+    return await db.payment_transactions.find_one_and_update(
+        {"session_id": session_id, "payment_status": {"$in": sources}},
+        {"$set": {
+            "payment_status": target,
+            f"status_timestamps.{target.value}": now,
+            "updated_at": now,
+            **(extra_fields or {})
+        }},
+        projection=projection or {"_id": 0, "payment_status": 1}
+    )
+
+async def complete_transaction(session_id: str, extra_fields: Optional[Dict] = None) -> bool:
+    """Mark a transaction COMPLETED once; returns True only for the call that completed it"""
+    now = datetime.now(timezone.utc)
+    transaction = await transition_transaction(
+        session_id,
+        PaymentStatus.COMPLETED,
+        {"completed_at": now, "revenue_booked": False, **(extra_fields or {})},
+        projection={"_id": 0, "service_type": 1, "amount": 1, "currency": 1, "metadata": 1},
+        now=now
+    )
+    if transaction is None:
+        return False
+    await record_revenue(session_id, transaction["service_type"], transaction["amount"], now)
+    checkout_status_cache.pop(session_id)
+    checkout_status = (extra_fields or {}).get("checkout_status") or checkout_status_from_transaction(
+        {**transaction, "payment_status": PaymentStatus.COMPLETED}
+    )
+    checkout_events.publish(session_id, checkout_status)
+    return True
+
+def checkout_status_from_transaction(transaction):
+    """Rebuild the Stripe status answer for a terminal transaction stored without one"""
+    completed = transaction["payment_status"] == PaymentStatus.COMPLETED
+    return {
+        "status": "complete" if completed else "expired",
+        "payment_status": "paid" if completed else "unpaid",
+        "amount_total": int(round(transaction["amount"] * 100)),
+        "currency": transaction.get("currency", "brl"),
+        "metadata": transaction.get("metadata") or {}
+    }
+
+async def load_terminal_checkout_status(session_id: str):
+    """Stored status of a settled transaction, or None while it is still open"""
+    transaction = await routed_db("primary").payment_transactions.find_one(
+        {"session_id": session_id},
+        {"_id": 0, "payment_status": 1, "checkout_status": 1, "amount": 1, "currency": 1, "metadata": 1}
+    )
+    if transaction and transaction["payment_status"] in TERMINAL_PAYMENT_STATUSES:
+        return transaction.get("checkout_status") or checkout_status_from_transaction(transaction)
+    return None
+
+async def load_checkout_status(session_id: str, stripe_gateway: StripeGateway):
+    checkout_status = await load_terminal_checkout_status(session_id)
+    if checkout_status is not None:
+        return checkout_status
+    
+    # Get status from Stripe
+    status_response = await stripe_gateway.get_checkout_status(session_id)
+    return await apply_checkout_status(session_id, status_response)
+
+async def apply_checkout_status(session_id: str, status_response):
+    """Store a Stripe checkout status on the transaction and return it in API shape"""
+    checkout_status = {
+        "status": status_response.status,
+        "payment_status": status_response.payment_status,
+        "amount_total": status_response.amount_total,
+        "currency": status_response.currency,
+        "metadata": status_response.metadata
+    }
+    
+    # Update local transaction record
+    if status_response.payment_status == "paid":
+        await complete_transaction(session_id, {"checkout_status": checkout_status})
+        return checkout_status
+    
+    # An unchanged answer matches no transition, so repeat polls write nothing
+    now = datetime.now(timezone.utc)
+    if status_response.status == "expired":
+        target, extra_fields = PaymentStatus.EXPIRED, {"checkout_status": checkout_status}
+    else:
+        target, extra_fields = PaymentStatus.PENDING, {
+            "checkout_status": checkout_status,
+            "reconcile_after": now + timedelta(seconds=RECONCILE_STALE_SECONDS)
+        }
+    
+    transaction = await transition_transaction(session_id, target, extra_fields, now=now)
+    if transaction is not None and target in TERMINAL_PAYMENT_STATUSES:
+        checkout_status_cache.pop(session_id)
+        checkout_events.publish(session_id, checkout_status)
+    
+    return checkout_status
+
+async def fetch_checkout_status(session_id: str, stripe_gateway: StripeGateway):
+    checkout_status = checkout_status_cache.get(session_id)
+    if checkout_status is None:
+        checkout_status = await checkout_status_flight.run(
+            session_id, lambda: load_checkout_status(session_id, stripe_gateway)
+        )
+        checkout_status_cache.set(session_id, checkout_status)
+    return checkout_status
+
 @api_router.get("/checkout/status/{session_id}")
-async def get_checkout_status(session_id: str):
+async def get_checkout_status(session_id: str, stripe_gateway: StripeGateway = Depends(get_stripe_gateway)):
     try:
-        # Initialize Stripe checkout (webhook_url not needed for status check)
-        stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url="")
-        
-        # Get status from Stripe
-        status_response = await stripe_checkout.get_checkout_status(session_id)
+        return await fetch_checkout_status(session_id, stripe_gateway)
         
-        # Update local transaction record
-        update_data = {
-            "payment_status": PaymentStatus.COMPLETED if status_response.payment_status == "paid" else PaymentStatus.PENDING,
-            "updated_at": datetime.now(timezone.utc)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao verificar status do pagamento: {str(e)}")
+
+# Checkout status push: the success page holds one SSE connection per session
+# instead of polling. Whoever settles a transaction in this process (status
+# poll, webhook worker, reconciler) publishes to the session's subscribers;
+# heartbeats re-read Mongo to catch transactions settled by another process
+CHECKOUT_EVENTS_HEARTBEAT_SECONDS = float(os.environ.get("CHECKOUT_EVENTS_HEARTBEAT_SECONDS", "15"))
+CHECKOUT_EVENTS_MAX_SECONDS = float(os.environ.get("CHECKOUT_EVENTS_MAX_SECONDS", "600"))
+
+def checkout_status_is_final(checkout_status) -> bool:
+    return checkout_status["payment_status"] == "paid" or checkout_status["status"] == "expired"
+
+class CheckoutStatusBroker:
+    def __init__(self):
+        self._subscribers: Dict[str, set] = {}
+
+    def subscribe(self, session_id: str) -> asyncio.Queue:
+        queue = asyncio.Queue()
+        self._subscribers.setdefault(session_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, session_id: str, queue: asyncio.Queue):
+        queues = self._subscribers.get(session_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[session_id]
+
+    def publish(self, session_id: str, checkout_status):
+        for queue in self._subscribers.get(session_id, ()):
+            queue.put_nowait(checkout_status)
+
+checkout_events = CheckoutStatusBroker()
+
+def format_sse(event: str, data) -> bytes:
+    return b"event: " + event.encode() + b"\ndata: " + orjson.dumps(data, default=orjson_default) + b"\n\n"
+
+@api_router.get("/checkout/events/{session_id}")
+async def checkout_status_events(session_id: str, stripe_gateway: StripeGateway = Depends(get_stripe_gateway)):
+    # Subscribe before the first read so a transition in between is not lost
+    queue = checkout_events.subscribe(session_id)
+    try:
+        if not await routed_db("primary").payment_transactions.find_one({"session_id": session_id}, {"_id": 1}):
+            raise HTTPException(status_code=404, detail="Sessão não encontrada")
+        checkout_status = await fetch_checkout_status(session_id, stripe_gateway)
+    except HTTPException:
+        checkout_events.unsubscribe(session_id, queue)
+        raise
+    except Exception as e:
+        checkout_events.unsubscribe(session_id, queue)
+        raise HTTPException(status_code=500, detail=f"Erro ao verificar status do pagamento: {str(e)}")
+    
+    async def stream(checkout_status):
+        deadline = time.monotonic() + CHECKOUT_EVENTS_MAX_SECONDS
+        try:
+            yield format_sse("status", checkout_status)
+            while not checkout_status_is_final(checkout_status) and time.monotonic() < deadline:
+                try:
+                    checkout_status = await asyncio.wait_for(queue.get(), CHECKOUT_EVENTS_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    settled = await load_terminal_checkout_status(session_id)
+                    if settled is None:
+                        yield b": keepalive\n\n"
+                        continue
+                    checkout_status = settled
+                yield format_sse("status", checkout_status)
+        finally:
+            checkout_events.unsubscribe(session_id, queue)
+    
+    return StreamingResponse(
+        stream(checkout_status),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+# Webhook intake: verified events are stored in a Mongo inbox keyed by event id
+# and acknowledged at once; WebhookInboxWorker applies them in batches, so a
+# Stripe retry of an event we already hold is a no-op
+WEBHOOK_HANDLED_EVENTS = {"checkout.session.completed"}
+WEBHOOK_WORKERS = int(os.environ.get("WEBHOOK_WORKERS", "2"))
+WEBHOOK_BATCH_SIZE = int(os.environ.get("WEBHOOK_BATCH_SIZE", "50"))
+WEBHOOK_POLL_SECONDS = float(os.environ.get("WEBHOOK_POLL_SECONDS", "1"))
+WEBHOOK_LEASE_SECONDS = 60
+WEBHOOK_MAX_ATTEMPTS = 10
+
+class WebhookInboxWorker:
+    def __init__(self, workers: int, batch_size: int, poll_seconds: float):
+        self.workers = workers
+        self.batch_size = batch_size
+        self.poll_seconds = poll_seconds
+        self._wakeup = asyncio.Event()
+        self._tasks = []
+
+    def notify(self):
+        self._wakeup.set()
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    async def _run(self):
+        while True:
+            try:
+                processed = await self.process_batch()
+            except Exception as e:
+                logger.error(f"Error processing webhook inbox: {e}")
+                processed = 0
+            if processed < self.batch_size:
+                # Idle until this worker enqueues something, or poll for events
+                # received by other workers
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_seconds)
+                except asyncio.TimeoutError:
+                    pass
+                self._wakeup.clear()
+
+    async def _claim(self):
+        """Lease up to batch_size pending (or abandoned) events to this worker"""
+        now = datetime.now(timezone.utc)
+        abandoned = {"status": "processing", "locked_at": {"$lt": now - timedelta(seconds=WEBHOOK_LEASE_SECONDS)}}
+        claimable = {
+            "attempts": {"$lt": WEBHOOK_MAX_ATTEMPTS},
+            "$or": [{"status": "pending"}, abandoned]
         }
+        candidates = await db.webhook_inbox.find(claimable, {"_id": 1}).sort("received_at", 1).limit(self.batch_size).to_list(self.batch_size)
+        if not candidates:
+            # Events whose last attempt was abandoned by a dead worker are never
+            # claimable again; retire them while idle so they show up as failed
+            await self._fail_events(
+                {**abandoned, "attempts": {"$gte": WEBHOOK_MAX_ATTEMPTS}},
+                "Lease expired on the last attempt"
+            )
+            return None, []
         
-        if status_response.status == "expired":
-            update_data["payment_status"] = PaymentStatus.EXPIRED
-        
-        await db.payment_transactions.update_one(
-            {"session_id": session_id},
-            {"$set": update_data}
+        lock_token = str(uuid.uuid4())
+        await db.webhook_inbox.update_many(
+            {"_id": {"$in": [c["_id"] for c in candidates]}, **claimable},
+            {"$set": {"status": "processing", "lock_token": lock_token, "locked_at": now}, "$inc": {"attempts": 1}}
         )
+        events = await db.webhook_inbox.find({"lock_token": lock_token}).to_list(self.batch_size)
+        return lock_token, events
+    
+    async def _fail_events(self, query, error):
+        failed = await db.webhook_inbox.update_many(
+            query,
+            {"$set": {"status": "failed", "last_error": error, "failed_at": datetime.now(timezone.utc)}, "$unset": {"lock_token": ""}}
+        )
+        if failed.modified_count:
+            logger.error(f"Webhook events gave up after {WEBHOOK_MAX_ATTEMPTS} attempts ({failed.modified_count}): {error}")
+
+    async def process_batch(self):
+        lock_token, events = await self._claim()
+        if not events:
+            return 0
         
-        return {
-            "status": status_response.status,
-            "payment_status": status_response.payment_status,
-            "amount_total": status_response.amount_total,
-            "currency": status_response.currency,
-            "metadata": status_response.metadata
+        completed_sessions = sorted({e["session_id"] for e in events if e["event_type"] == "checkout.session.completed"})
+        results = await asyncio.gather(
+            *(complete_transaction(session_id) for session_id in completed_sessions),
+            return_exceptions=True
+        )
+        errors = {
+            session_id: f"{type(result).__name__}: {result}"
+            for session_id, result in zip(completed_sessions, results)
+            if isinstance(result, Exception)
         }
         
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Erro ao verificar status do pagamento: {str(e)}")
+        # Failed events keep their lease, so they are retried once it expires
+        # unless this was their last attempt
+        for session_id, error in errors.items():
+            logger.error(f"Error applying webhook for session {session_id}: {error}")
+            await self._fail_events(
+                {"lock_token": lock_token, "session_id": session_id, "attempts": {"$gte": WEBHOOK_MAX_ATTEMPTS}},
+                error
+            )
+            await db.webhook_inbox.update_many(
+                {"lock_token": lock_token, "session_id": session_id},
+                {"$set": {"last_error": error}}
+            )
+        await db.webhook_inbox.update_many(
+            {"lock_token": lock_token, "session_id": {"$nin": list(errors)}},
+            {"$set": {"status": "done", "processed_at": datetime.now(timezone.utc)}, "$unset": {"lock_token": ""}}
+        )
+        return len(events)
+
+async def replay_failed_webhooks() -> int:
+    """Put every failed inbox event back in the queue with fresh attempts"""
+    replayed = await db.webhook_inbox.update_many(
+        {"status": "failed"},
+        {"$set": {"status": "pending", "attempts": 0}, "$unset": {"failed_at": ""}}
+    )
+    webhook_worker.notify()
+    return replayed.modified_count
+
+webhook_worker = WebhookInboxWorker(WEBHOOK_WORKERS, WEBHOOK_BATCH_SIZE, WEBHOOK_POLL_SECONDS)
+
+# Reconciler: transactions nobody polls and no webhook completes are picked up
+# once reconcile_after passes, claimed one by one so several app workers never
+# ask Stripe about the same session, and checked with bounded concurrency.
+# Each pass also books revenue for completed transactions a crash left unbooked
+RECONCILE_ENABLED = os.environ.get("RECONCILE_ENABLED", "1") == "1"
+RECONCILE_INTERVAL_SECONDS = float(os.environ.get("RECONCILE_INTERVAL_SECONDS", "60"))
+RECONCILE_STALE_SECONDS = float(os.environ.get("RECONCILE_STALE_SECONDS", "300"))
+RECONCILE_BATCH_SIZE = int(os.environ.get("RECONCILE_BATCH_SIZE", "100"))
+RECONCILE_CONCURRENCY = int(os.environ.get("RECONCILE_CONCURRENCY", "5"))
+RECONCILE_ERROR_BACKOFF_SECONDS = 3600
+
+async def reconcile_stale_transactions(stripe_gateway: StripeGateway) -> Dict[str, int]:
+    """Run one reconciliation pass over due open transactions; returns outcome
+    counts, with "due" the number of rows the pass picked up"""
+    now = datetime.now(timezone.utc)
+    due = await routed_db("primary").payment_transactions.find(
+        {"payment_status": {"$in": OPEN_PAYMENT_STATUSES}, "reconcile_after": {"$lte": now}},
+        {"_id": 0, "session_id": 1}
+    ).sort("reconcile_after", 1).limit(RECONCILE_BATCH_SIZE).to_list(RECONCILE_BATCH_SIZE)
+    
+    outcomes = {"due": len(due), "checked": 0, "completed": 0, "expired": 0, "open": 0, "errors": 0}
+    semaphore = asyncio.Semaphore(RECONCILE_CONCURRENCY)
+    
+    async def reconcile(session_id):
+        # Claim the row by pushing reconcile_after forward; losing the race
+        # means another worker is already on it
+        claim = await db.payment_transactions.update_one(
+            {"session_id": session_id, "payment_status": {"$in": OPEN_PAYMENT_STATUSES}, "reconcile_after": {"$lte": now}},
+            {"$set": {"reconcile_after": now + timedelta(seconds=RECONCILE_STALE_SECONDS)}}
+        )
+        if claim.modified_count == 0:
+            return
+        async with semaphore:
+            try:
+                status_response = await stripe_gateway.get_checkout_status(session_id)
+                checkout_status = await apply_checkout_status(session_id, status_response)
+            except Exception as e:
+                logger.error(f"Error reconciling transaction {session_id}: {e}")
+                outcomes["errors"] += 1
+                await db.payment_transactions.update_one(
+                    {"session_id": session_id},
+                    {"$set": {"reconcile_after": now + timedelta(seconds=RECONCILE_ERROR_BACKOFF_SECONDS)}}
+                )
+                return
+        outcomes["checked"] += 1
+        if checkout_status["payment_status"] == "paid":
+            outcomes["completed"] += 1
+        elif checkout_status["status"] == "expired":
+            outcomes["expired"] += 1
+        else:
+            outcomes["open"] += 1
+    
+    await asyncio.gather(*(reconcile(t["session_id"]) for t in due))
+    return outcomes
+
+REVENUE_SWEEP_GRACE_SECONDS = 60
+
+async def book_unbooked_revenue() -> int:
+    """Book revenue for completed transactions whose rollup increment never ran"""
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=REVENUE_SWEEP_GRACE_SECONDS)
+    unbooked = await routed_db("primary").payment_transactions.find(
+        {"revenue_booked": False, "completed_at": {"$lte": cutoff}},
+        {"_id": 0, "session_id": 1, "service_type": 1, "amount": 1, "completed_at": 1}
+    ).limit(RECONCILE_BATCH_SIZE).to_list(RECONCILE_BATCH_SIZE)
+    for transaction in unbooked:
+        completed_at = transaction["completed_at"].replace(tzinfo=timezone.utc)
+        await record_revenue(transaction["session_id"], transaction["service_type"], transaction["amount"], completed_at)
+    if unbooked:
+        logger.warning(f"Booked revenue for {len(unbooked)} completed transactions left unbooked")
+    return len(unbooked)
+
+class TransactionReconciler:
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self._task = None
+
+    def start(self, stripe_gateway: StripeGateway):
+        self._task = asyncio.create_task(self._run(stripe_gateway))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self, stripe_gateway: StripeGateway):
+        while True:
+            try:
+                outcomes = await reconcile_stale_transactions(stripe_gateway)
+                if outcomes["checked"] or outcomes["errors"]:
+                    logger.info(f"Reconciled transactions: {outcomes}")
+                await book_unbooked_revenue()
+            except Exception as e:
+                logger.error(f"Error in transaction reconciler: {e}")
+                outcomes = {}
+            # A full batch means more are due; keep going without sleeping
+            if outcomes.get("due", 0) < RECONCILE_BATCH_SIZE:
+                await asyncio.sleep(self.interval_seconds)
+
+reconciler = TransactionReconciler(RECONCILE_INTERVAL_SECONDS)
 
 @api_router.post("/webhook/stripe")
-async def stripe_webhook(request: Request, stripe_signature: str = Header(None)):
+async def stripe_webhook(request: Request, stripe_signature: str = Header(None), stripe_gateway: StripeGateway = Depends(get_stripe_gateway)):
     try:
         body = await request.body()
         
-        # Initialize Stripe checkout
-        stripe_checkout = StripeCheckout(api_key=stripe_api_key, webhook_url="")
-        
-        # Handle webhook
-        webhook_response = await stripe_checkout.handle_webhook(body, stripe_signature)
+        # Verify the webhook
+        webhook_response = await stripe_gateway.handle_webhook(body, stripe_signature)
         
-        if webhook_response.event_type == "checkout.session.completed":
-            # Update payment transaction
-            await db.payment_transactions.update_one(
-                {"session_id": webhook_response.session_id},
-                {"$set": {
-                    "payment_status": PaymentStatus.COMPLETED,
-                    "updated_at": datetime.now(timezone.utc)
-                }}
-            )
+        if webhook_response.event_type in WEBHOOK_HANDLED_EVENTS:
+            try:
+                await db.webhook_inbox.insert_one({
+                    "_id": webhook_response.event_id,
+                    "event_type": webhook_response.event_type,
+                    "session_id": webhook_response.session_id,
+                    "payment_status": webhook_response.payment_status,
+                    "status": "pending",
+                    "attempts": 0,
+                    "received_at": datetime.now(timezone.utc)
+                })
+                webhook_worker.notify()
+            except DuplicateKeyError:
+                pass  # Stripe retry of an event already in the inbox
         
         return {"status": "success"}
         
@@ -389,7 +1548,7 @@ async def stripe_webhook(request: Request, stripe_signature: str = Header(None))
 async def submit_client_form(form_data: ClientFormCreate):
     try:
         # Verify payment was completed
-        transaction = await db.payment_transactions.find_one({"session_id": form_data.payment_session_id})
+        transaction = await routed_db("primary").payment_transactions.find_one({"session_id": form_data.payment_session_id})
         if not transaction or transaction["payment_status"] != PaymentStatus.COMPLETED:
             raise HTTPException(status_code=400, detail="Pagamento não encontrado ou não confirmado")
         
@@ -402,6 +1561,73 @@ async def submit_client_form(form_data: ClientFormCreate):
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao enviar formulário: {str(e)}")
 
+# Helper function to resolve display names for many service types at once
+async def resolve_service_names(database, service_types):
+    """Map each service type to its ritual name with a single query, falling back to legacy services"""
+    service_types = set(service_types)
+    names = {}
+    if service_types:
+        async for ritual in database.rituais.find({"id": {"$in": list(service_types)}}, {"_id": 0, "id": 1, "name": 1}):
+            names[ritual["id"]] = ritual["name"]
+    for service_type in service_types - names.keys():
+        names[service_type] = LEGACY_SERVICES.get(service_type, {}).get("name", "Serviço desconhecido")
+    return names
+
+# Keyset pagination for admin lists: the opaque cursor carries the sort key
+# values of the last row served, so every page is an index range scan
+ADMIN_PAGE_SIZE = 1000
+
+CLIENTS_SORT = [("created_at", -1), ("id", -1)]
+CONSULTAS_SORT = [("data_consulta", 1), ("horario", 1), ("id", 1)]
+RITUAIS_SORT = [("created_at", -1), ("id", -1)]
+FLYERS_SORT = [("created_at", -1), ("id", -1)]
+TRANSACTIONS_SORT = [("created_at", -1), ("id", -1)]
+
+# Admin list projections: drop _id and fields the admin panel never reads
+ADMIN_LIST_PROJECTION = {"_id": 0}
+TRANSACTIONS_LIST_PROJECTION = {"_id": 0, "metadata": 0, "checkout_status": 0}
+
+class PageRequest(BaseModel):
+    after: Optional[List[Any]] = None
+    limit: int = ADMIN_PAGE_SIZE
+
+def encode_cursor(values: List[Any]) -> str:
+    return base64.urlsafe_b64encode(json_util.dumps(values).encode("utf-8")).decode("ascii")
+
+def decode_cursor(cursor: str) -> List[Any]:
+    try:
+        values = json_util.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    if not isinstance(values, list):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    return values
+
+async def page_params(cursor: Optional[str] = None, limit: int = Query(ADMIN_PAGE_SIZE, ge=1, le=ADMIN_PAGE_SIZE)) -> PageRequest:
+    return PageRequest(after=decode_cursor(cursor) if cursor else None, limit=limit)
+
+def keyset_filter(sort, after):
+    """Match documents strictly after the given sort key values"""
+    if len(after) != len(sort):
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {prev_field: after[j] for j, (prev_field, _) in enumerate(sort[:i])}
+        clause[field] = {"$gt" if direction == 1 else "$lt": after[i]}
+        clauses.append(clause)
+    return {"$or": clauses}
+
+async def paginate(collection, query, sort, page: PageRequest, projection=None):
+    """Fetch one page in sort order; returns (documents, next_cursor)"""
+    if page.after is not None:
+        query = {"$and": [query, keyset_filter(sort, page.after)]}
+    documents = await collection.find(query, projection).sort(sort).limit(page.limit + 1).to_list(page.limit + 1)
+    next_cursor = None
+    if len(documents) > page.limit:
+        documents = documents[:page.limit]
+        next_cursor = encode_cursor([documents[-1].get(field) for field, _ in sort])
+    return documents, next_cursor
+
 # Admin Routes
 @api_router.post("/admin/login")
 async def admin_login(login_data: AdminLogin):
@@ -410,32 +1636,36 @@ async def admin_login(login_data: AdminLogin):
     return {"message": "Login realizado com sucesso", "token": "admin_authenticated"}
 
 @api_router.get("/admin/clients")
-async def get_clients(authorization: str = Header(None)):
+async def get_clients(page: PageRequest = Depends(page_params), reporting_db: RoutedDatabase = Depends(read_policy("reporting")), authorization: str = Header(None)):
     if authorization != "Bearer admin_authenticated":
         raise HTTPException(status_code=401, detail="Não autorizado")
     
     try:
         # Get all client forms with payment info
-        clients = await db.client_forms.find().to_list(1000)
+        clients, next_cursor = await paginate(reporting_db.client_forms, {}, CLIENTS_SORT, page, ADMIN_LIST_PROJECTION)
+        
+        # Enrich with payment information: one batched read per collection
+        # instead of two lookups per client
+        session_ids = list({client["payment_session_id"] for client in clients})
+        transactions = {}
+        if session_ids:
+            async for transaction in reporting_db.payment_transactions.find(
+                {"session_id": {"$in": session_ids}},
+                {"_id": 0, "session_id": 1, "service_type": 1, "amount": 1, "payment_status": 1}
+            ):
+                transactions.setdefault(transaction["session_id"], transaction)
+        service_names = await resolve_service_names(reporting_db, (t["service_type"] for t in transactions.values()))
         
-        # Enrich with payment information
         for client in clients:
-            transaction = await db.payment_transactions.find_one({"session_id": client["payment_session_id"]})
+            transaction = transactions.get(client["payment_session_id"])
             if transaction:
-                # Try to get service name from database
-                ritual = await db.rituais.find_one({"id": transaction["service_type"]})
-                service_name = ritual["name"] if ritual else LEGACY_SERVICES.get(transaction["service_type"], {}).get("name", "Serviço desconhecido")
-                
                 client["payment_info"] = {
                     "amount": transaction["amount"],
                     "payment_status": transaction["payment_status"],
-                    "service_name": service_name
+                    "service_name": service_names[transaction["service_type"]]
                 }
         
-        # Serialize MongoDB data to make it JSON compatible
-        clients = serialize_mongo_data(clients)
-        
-        return {"clients": clients}
+        return FastJSONResponse({"clients": clients, "next_cursor": next_cursor})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar clientes: {str(e)}")
 
@@ -483,38 +1713,32 @@ async def update_client_status(client_id: str, status: str, authorization: str =
 @api_router.post("/consulta/agendar")
 async def agendar_consulta(consulta: ConsultaAgendamentoCreate):
     try:
-        # Check if slot is available
-        existing = await db.consultas.find_one({
-            "data_consulta": consulta.data_consulta,
-            "horario": consulta.horario,
-            "status": {"$in": ["agendado", "confirmado"]}
-        })
-        
-        if existing:
-            raise HTTPException(status_code=400, detail="Horário já ocupado")
-        
-        # Create consultation
+        # Create consultation; the unique active-slot index rejects a taken slot
         nova_consulta = ConsultaAgendamento(**consulta.dict())
-        await db.consultas.insert_one(nova_consulta.dict())
+        try:
+            await db.consultas.insert_one(nova_consulta.dict())
+        except DuplicateKeyError:
+            raise HTTPException(status_code=400, detail="Horário já ocupado")
+        slot_cache.invalidate(nova_consulta.data_consulta)
         
         return {
             "message": "Consulta agendada com sucesso!",
             "consulta_id": nova_consulta.id,
             "whatsapp_link": f"https://wa.me/5511999999999?text=Olá! Agendei uma consulta para {consulta.data_consulta} às {consulta.horario}. Aguardo confirmação."
         }
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao agendar consulta: {str(e)}")
 
 @api_router.get("/admin/consultas")
-async def get_consultas(authorization: str = Header(None)):
+async def get_consultas(page: PageRequest = Depends(page_params), reporting_db: RoutedDatabase = Depends(read_policy("reporting")), authorization: str = Header(None)):
     if authorization != "Bearer admin_authenticated":
         raise HTTPException(status_code=401, detail="Não autorizado")
     
     try:
-        consultas = await db.consultas.find().sort("data_consulta", 1).to_list(1000)
-        # Serialize MongoDB data to make it JSON compatible
-        consultas = serialize_mongo_data(consultas)
-        return {"consultas": consultas}
+        consultas, next_cursor = await paginate(reporting_db.consultas, {}, CONSULTAS_SORT, page, ADMIN_LIST_PROJECTION)
+        return FastJSONResponse({"consultas": consultas, "next_cursor": next_cursor})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar consultas: {str(e)}")
 
@@ -528,26 +1752,37 @@ async def update_consulta_status(consulta_id: str, status: str, authorization: s
         raise HTTPException(status_code=400, detail="Status inválido")
     
     try:
-        await db.consultas.update_one(
-            {"id": consulta_id},
-            {"$set": {"status": status, "updated_at": datetime.now(timezone.utc)}}
-        )
+        try:
+            consulta = await db.consultas.find_one_and_update(
+                {"id": consulta_id},
+                {"$set": {
+                    "status": status,
+                    "ocupa_horario": status in ACTIVE_CONSULTA_STATUSES,
+                    "updated_at": datetime.now(timezone.utc)
+                }},
+                projection={"_id": 0, "data_consulta": 1}
+            )
+        except DuplicateKeyError:
+            # Reactivating a cancelled consulta whose slot was booked again
+            raise HTTPException(status_code=400, detail="Horário já ocupado")
+        if consulta:
+            slot_cache.invalidate(consulta["data_consulta"])
         
         return {"message": "Status da consulta atualizado"}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao atualizar consulta: {str(e)}")
 
 # Rituais CRUD Routes
 @api_router.get("/admin/rituais")
-async def get_all_rituais(authorization: str = Header(None)):
+async def get_all_rituais(page: PageRequest = Depends(page_params), authorization: str = Header(None)):
     if authorization != "Bearer admin_authenticated":
         raise HTTPException(status_code=401, detail="Não autorizado")
     
     try:
-        rituais = await db.rituais.find().sort("created_at", -1).to_list(1000)
-        # Serialize MongoDB data to make it JSON compatible
-        rituais = serialize_mongo_data(rituais)
-        return {"rituais": rituais}
+        rituais, next_cursor = await paginate(db.rituais, {}, RITUAIS_SORT, page, ADMIN_LIST_PROJECTION)
+        return FastJSONResponse({"rituais": rituais, "next_cursor": next_cursor})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar rituais: {str(e)}")
 
@@ -560,6 +1795,7 @@ async def create_ritual(ritual: RitualCreate, authorization: str = Header(None))
         # Create new ritual
         novo_ritual = Ritual(**ritual.dict())
         await db.rituais.insert_one(novo_ritual.dict())
+        services_cache.invalidate()
         
         return {"message": "Ritual criado com sucesso", "ritual_id": novo_ritual.id}
     except Exception as e:
@@ -583,6 +1819,7 @@ async def update_ritual(ritual_id: str, ritual_update: RitualUpdate, authorizati
             
             if result.matched_count == 0:
                 raise HTTPException(status_code=404, detail="Ritual não encontrado")
+            services_cache.invalidate()
         
         return {"message": "Ritual atualizado com sucesso"}
     except Exception as e:
@@ -598,6 +1835,7 @@ async def delete_ritual(ritual_id: str, authorization: str = Header(None)):
         
         if result.deleted_count == 0:
             raise HTTPException(status_code=404, detail="Ritual não encontrado")
+        services_cache.invalidate()
         
         return {"message": "Ritual deletado com sucesso"}
     except Exception as e:
@@ -610,94 +1848,344 @@ async def create_flyer(flyer: FlyerContentCreate, authorization: str = Header(No
         raise HTTPException(status_code=401, detail="Não autorizado")
     
     try:
-        # Deactivate other flyers
-        await db.flyers.update_many({}, {"$set": {"ativo": False}})
-        
-        # Create new active flyer
+        # Create the new active flyer first, then retire only active flyers
+        # older than it. Readers take the newest active flyer, so they see the
+        # old or the new one; two concurrent creates each retire only what is
+        # older than themselves, so the newest of them always stays active
         novo_flyer = FlyerContent(**flyer.dict())
         await db.flyers.insert_one(novo_flyer.dict())
+        await db.flyers.update_many(
+            {"ativo": True, "created_at": {"$lt": novo_flyer.created_at}},
+            {"$set": {"ativo": False}}
+        )
+        active_flyer_cache.invalidate()
         
         return {"message": "Flyer criado com sucesso", "flyer_id": novo_flyer.id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao criar flyer: {str(e)}")
 
+async def load_active_flyer():
+    flyer = await db.flyers.find_one({"ativo": True}, {"_id": 0}, sort=[("created_at", -1)])
+    return {"flyer": flyer}
+
+# Storefront flyer, rebuilt after this worker creates a flyer and at least
+# every FLYER_CACHE_TTL_SECONDS for flyers created elsewhere
+FLYER_CACHE_TTL_SECONDS = float(os.environ.get("FLYER_CACHE_TTL_SECONDS", "30"))
+
+active_flyer_cache = VersionedResponseCache(load_active_flyer, FLYER_CACHE_TTL_SECONDS)
+
 @api_router.get("/flyer-ativo")
-async def get_active_flyer():
-    try:
-        flyer = await db.flyers.find_one({"ativo": True})
-        if flyer:
-            # Serialize MongoDB data to make it JSON compatible
-            flyer = serialize_mongo_data(flyer)
-            return {"flyer": flyer}
-        return {"flyer": None}
+async def get_active_flyer(request: Request):
+    try:
+        body, etag = await active_flyer_cache.get()
+        return cached_json_response(request, body, etag)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar flyer: {str(e)}")
 
 @api_router.get("/admin/flyers")
-async def get_all_flyers(authorization: str = Header(None)):
+async def get_all_flyers(page: PageRequest = Depends(page_params), authorization: str = Header(None)):
     if authorization != "Bearer admin_authenticated":
         raise HTTPException(status_code=401, detail="Não autorizado")
     
     try:
-        flyers = await db.flyers.find().sort("created_at", -1).to_list(1000)
-        # Serialize MongoDB data to make it JSON compatible
-        flyers = serialize_mongo_data(flyers)
-        return {"flyers": flyers}
+        flyers, next_cursor = await paginate(db.flyers, {}, FLYERS_SORT, page, ADMIN_LIST_PROJECTION)
+        return FastJSONResponse({"flyers": flyers, "next_cursor": next_cursor})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar flyers: {str(e)}")
 
 @api_router.get("/admin/transactions")
-async def get_transactions(authorization: str = Header(None)):
+async def get_transactions(page: PageRequest = Depends(page_params), reporting_db: RoutedDatabase = Depends(read_policy("reporting")), authorization: str = Header(None)):
     if authorization != "Bearer admin_authenticated":
         raise HTTPException(status_code=401, detail="Não autorizado")
     
     try:
-        transactions = await db.payment_transactions.find().sort("created_at", -1).to_list(1000)
+        transactions, next_cursor = await paginate(reporting_db.payment_transactions, {}, TRANSACTIONS_SORT, page, TRANSACTIONS_LIST_PROJECTION)
         
-        # Enrich with service information
+        # Enrich with service information, resolving every distinct service type at once
+        service_names = await resolve_service_names(
+            reporting_db,
+            (t["service_type"] for t in transactions if "service_type" in t)
+        )
         for transaction in transactions:
             if "service_type" in transaction:
-                # Try to get service name from database
-                ritual = await db.rituais.find_one({"id": transaction["service_type"]})
-                service_name = ritual["name"] if ritual else LEGACY_SERVICES.get(transaction["service_type"], {}).get("name", "Serviço desconhecido")
-                
                 transaction["metadata"] = {
-                    "service_name": service_name
+                    "service_name": service_names[transaction["service_type"]]
                 }
         
-        # Serialize MongoDB data to make it JSON compatible
-        transactions = serialize_mongo_data(transactions)
-        
-        return {"transactions": transactions}
+        return FastJSONResponse({"transactions": transactions, "next_cursor": next_cursor})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar transações: {str(e)}")
 
-@api_router.get("/horarios-disponiveis/{data}")
-async def get_available_slots(data: str):
-    try:
-        # Get occupied slots for the date
-        consultas_dia = await db.consultas.find({
-            "data_consulta": data,
-            "status": {"$in": ["agendado", "confirmado"]}
-        }).to_list(1000)
-        
-        occupied_slots = [c["horario"] for c in consultas_dia]
+# Streaming exports: rows go straight from a Motor cursor to the client in
+# small chunks, so memory stays flat however large the collection is
+EXPORT_BATCH_SIZE = 500
+EXPORT_CHUNK_BYTES = 64 * 1024
+
+EXPORTS = {
+    "transactions": ("payment_transactions", [
+        "id", "session_id", "service_type", "amount", "currency", "payment_status",
+        "status_timestamps", "created_at", "updated_at"
+    ]),
+    "clients": ("client_forms", [
+        "id", "payment_session_id", "nome_completo", "data_nascimento", "telefone",
+        "nome_pessoa_amada", "situacao_atual", "observacoes", "service_type", "video_links",
+        "status", "created_at"
+    ]),
+    "consultas": ("consultas", [
+        "id", "nome_completo", "telefone", "data_consulta", "horario", "valor", "status",
+        "observacoes", "created_at"
+    ]),
+}
+
+def export_datetime(value: datetime) -> str:
+    # Mongo hands datetimes back naive; everything is stored in UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.isoformat()
+
+def export_json_default(value):
+    if isinstance(value, datetime):
+        return export_datetime(value)
+    return str(value)
+
+def export_csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return export_datetime(value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, default=export_json_default, ensure_ascii=False)
+    return value
+
+async def stream_export(collection, fields, export_format):
+    # Natural _id order needs no in-memory sort and is stable while streaming
+    cursor = collection.find({}, {"_id": 0, **{field: 1 for field in fields}}).sort("_id", 1).batch_size(EXPORT_BATCH_SIZE)
+    buffer = io.StringIO()
+    writer = csv.writer(buffer) if export_format == "csv" else None
+    if writer:
+        writer.writerow(fields)
+    first_row = True
+    async for document in cursor:
+        if writer:
+            writer.writerow([export_csv_value(document.get(field)) for field in fields])
+        else:
+            buffer.write(json.dumps(document, default=export_json_default, ensure_ascii=False))
+            buffer.write("\n")
+        # Flush the first row right away, then in fixed-size chunks
+        if first_row or buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            first_row = False
+    if buffer.tell():
+        yield buffer.getvalue().encode("utf-8")
+
+@api_router.get("/admin/export/{collection}")
+async def export_collection(collection: str, format: str = Query("ndjson", pattern="^(ndjson|csv)$"), reporting_db: RoutedDatabase = Depends(read_policy("reporting")), authorization: str = Header(None)):
+    if authorization != "Bearer admin_authenticated":
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    
+    if collection not in EXPORTS:
+        raise HTTPException(status_code=404, detail="Exportação não encontrada")
+    
+    collection_name, fields = EXPORTS[collection]
+    media_type = "text/csv; charset=utf-8" if format == "csv" else "application/x-ndjson"
+    filename = f"{collection}-{datetime.now(timezone.utc):%Y%m%d%H%M%S}.{format}"
+    return StreamingResponse(
+        stream_export(reporting_db[collection_name], fields, format),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+# Consulta slot template, configurable from .env (defaults: 14:00 to 22:00, 20min each)
+SLOT_START_HOUR = int(os.environ.get("SLOT_START_HOUR", "14"))
+SLOT_END_HOUR = int(os.environ.get("SLOT_END_HOUR", "22"))
+SLOT_MINUTES = int(os.environ.get("SLOT_MINUTES", "20"))
+SLOT_CACHE_TTL_SECONDS = float(os.environ.get("SLOT_CACHE_TTL_SECONDS", "30"))
+AVAILABILITY_MAX_DAYS = 62
+
+def build_slot_template(start_hour: int, end_hour: int, step_minutes: int) -> List[str]:
+    return [
+        f"{minutes // 60:02d}:{minutes % 60:02d}"
+        for minutes in range(start_hour * 60, end_hour * 60, step_minutes)
+    ]
+
+SLOT_TEMPLATE = build_slot_template(SLOT_START_HOUR, SLOT_END_HOUR, SLOT_MINUTES)
+SLOT_BITS = {slot: 1 << i for i, slot in enumerate(SLOT_TEMPLATE)}
+
+# Per-date occupancy bitmaps (bit i set = SLOT_TEMPLATE[i] taken). Bookings and
+# status changes on this worker invalidate their date; the TTL bounds how stale
+# a date can get from writes on other workers
+class SlotOccupancyCache:
+    def __init__(self, ttl_seconds: float, max_entries: int = 1000):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._bitmaps = {}
+        self._generation = 0
+
+    def _store(self, loaded: Dict[str, int], expires_at: float):
+        for data_consulta, bitmap in loaded.items():
+            self._bitmaps.pop(data_consulta, None)
+            self._bitmaps[data_consulta] = (bitmap, expires_at)
+        if len(self._bitmaps) > self.max_entries:
+            now = time.monotonic()
+            self._bitmaps = {k: v for k, v in self._bitmaps.items() if v[1] > now}
+            # Still full of live entries: drop the least recently loaded
+            while len(self._bitmaps) > self.max_entries:
+                self._bitmaps.pop(next(iter(self._bitmaps)))
+
+    def invalidate(self, data_consulta: str):
+        self._generation += 1
+        self._bitmaps.pop(data_consulta, None)
+
+    async def get_many(self, dates: List[str]) -> Dict[str, int]:
+        now = time.monotonic()
+        bitmaps = {}
+        missing = []
+        for data_consulta in dates:
+            cached = self._bitmaps.get(data_consulta)
+            if cached and cached[1] > now:
+                bitmaps[data_consulta] = cached[0]
+            else:
+                missing.append(data_consulta)
         
-        # Generate available slots (14:00 to 22:00, 20min each)
-        available_slots = []
-        start_hour = 14
-        end_hour = 22
+        if missing:
+            generation = self._generation
+            loaded = dict.fromkeys(missing, 0)
+            async for day in db.consultas.aggregate([
+                {"$match": {"data_consulta": {"$in": missing}, "ocupa_horario": True}},
+                {"$group": {"_id": "$data_consulta", "horarios": {"$addToSet": "$horario"}}}
+            ]):
+                for horario in day["horarios"]:
+                    loaded[day["_id"]] |= SLOT_BITS.get(horario, 0)
+            # Skip storing if a booking landed while we were reading
+            if generation == self._generation:
+                self._store(loaded, time.monotonic() + self.ttl_seconds)
+            bitmaps.update(loaded)
+        return bitmaps
+
+slot_cache = SlotOccupancyCache(SLOT_CACHE_TTL_SECONDS)
+
+def available_slots_from_bitmap(bitmap: int) -> List[str]:
+    return [slot for slot in SLOT_TEMPLATE if not bitmap & SLOT_BITS[slot]]
+
+# Dashboard stats are read from revenue_rollups, so cost depends on the date
+# range and number of services, never on how many transactions exist
+STATS_DEFAULT_DAYS = 30
+STATS_MAX_DAYS = 366
+
+@api_router.get("/admin/stats")
+async def get_stats(data_inicio: Optional[str] = Query(None, alias="from"), data_fim: Optional[str] = Query(None, alias="to"), authorization: str = Header(None)):
+    if authorization != "Bearer admin_authenticated":
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    
+    try:
+        end = date.fromisoformat(data_fim) if data_fim else datetime.now(timezone.utc).date()
+        start = date.fromisoformat(data_inicio) if data_inicio else end - timedelta(days=STATS_DEFAULT_DAYS - 1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Datas inválidas, use AAAA-MM-DD")
+    if not 0 <= (end - start).days < STATS_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Intervalo deve ter entre 1 e {STATS_MAX_DAYS} dias")
+    
+    try:
+        rollups = await db.revenue_rollups.find(
+            {"day": {"$gte": start.isoformat(), "$lte": end.isoformat()}},
+            {"_id": 0, "sessions": 0}
+        ).to_list(None)
         
-        for hour in range(start_hour, end_hour):
-            for minute in [0, 20, 40]:
-                slot = f"{hour:02d}:{minute:02d}"
-                if slot not in occupied_slots:
-                    available_slots.append(slot)
+        total = {"count": 0, "amount": 0.0}
+        by_service = {}
+        by_day = {}
+        for rollup in rollups:
+            for bucket in (total, by_service.setdefault(rollup["service_type"], {"count": 0, "amount": 0.0}),
+                           by_day.setdefault(rollup["day"], {"count": 0, "amount": 0.0})):
+                bucket["count"] += rollup["count"]
+                bucket["amount"] = round(bucket["amount"] + rollup["amount"], 2)
         
-        return {"horarios_disponiveis": available_slots}
+        return {
+            "from": start.isoformat(),
+            "to": end.isoformat(),
+            "total": total,
+            "by_service": by_service,
+            "by_day": [{"day": day, **by_day[day]} for day in sorted(by_day)]
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao buscar estatísticas: {str(e)}")
+
+async def rebuild_revenue_rollups():
+    """Recompute revenue_rollups from payment_transactions, replacing the collection"""
+    await db.payment_transactions.aggregate([
+        {"$match": {"payment_status": PaymentStatus.COMPLETED}},
+        {"$group": {
+            "_id": {
+                "day": {"$dateToString": {"format": "%Y-%m-%d", "date": {"$ifNull": ["$completed_at", "$updated_at"]}}},
+                "service_type": "$service_type"
+            },
+            "count": {"$sum": 1},
+            "amount": {"$sum": "$amount"},
+            "sessions": {"$push": "$session_id"}
+        }},
+        {"$project": {
+            "_id": {"$concat": ["$_id.day", ":", "$_id.service_type"]},
+            "day": "$_id.day",
+            "service_type": "$_id.service_type",
+            "count": 1,
+            "amount": 1,
+            "sessions": 1
+        }},
+        {"$out": "revenue_rollups"}
+    ]).to_list(None)
+
+@api_router.get("/horarios-disponiveis/{data}")
+async def get_available_slots(data: str):
+    try:
+        data = date.fromisoformat(data).isoformat()
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Data inválida, use AAAA-MM-DD")
+    
+    try:
+        bitmaps = await slot_cache.get_many([data])
+        return {"horarios_disponiveis": available_slots_from_bitmap(bitmaps[data])}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Erro ao buscar horários: {str(e)}")
+
+@api_router.get("/horarios-disponiveis")
+async def get_available_slots_range(data_inicio: str = Query(..., alias="from"), data_fim: str = Query(..., alias="to")):
+    try:
+        start = date.fromisoformat(data_inicio)
+        end = date.fromisoformat(data_fim)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Datas inválidas, use AAAA-MM-DD")
+    
+    days = (end - start).days + 1
+    if days < 1 or days > AVAILABILITY_MAX_DAYS:
+        raise HTTPException(status_code=400, detail=f"Intervalo deve ter entre 1 e {AVAILABILITY_MAX_DAYS} dias")
+    
+    try:
+        dates = [(start + timedelta(days=i)).isoformat() for i in range(days)]
+        bitmaps = await slot_cache.get_many(dates)
+        return {
+            "horarios_disponiveis": {
+                data_consulta: available_slots_from_bitmap(bitmaps[data_consulta]) for data_consulta in dates
+            },
+            "slot_template": SLOT_TEMPLATE
+        }
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Erro ao buscar horários: {str(e)}")
 
+@api_router.get("/admin/mongo-pool")
+async def get_mongo_pool(request: Request, authorization: str = Header(None)):
+    if authorization != "Bearer admin_authenticated":
+        raise HTTPException(status_code=401, detail="Não autorizado")
+    
+    return {
+        "options": mongo_client_options(),
+        "warmup_connections": MONGO_WARMUP_CONNECTIONS,
+        "warmup_ms": getattr(request.app.state, "startup_report", {}).get("stages_ms", {}).get("mongo_warmup"),
+        "pools": mongo_pool_metrics.snapshot(),
+        "read_policies": {policy: preference.document for policy, preference in READ_POLICIES.items()}
+    }
+
 # Include the router in the main app
 app.include_router(api_router)
 
@@ -709,6 +2197,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# Per-request Mongo/Stripe call counts; QUERY_BUDGET_HEADERS=1 exposes them as
+# response headers, QUERY_BUDGET_WARN sets the command count that gets logged
+app.add_middleware(
+    QueryBudgetMiddleware,
+    expose_headers=os.environ.get("QUERY_BUDGET_HEADERS", "0") == "1",
+    warn_threshold=int(os.environ.get("QUERY_BUDGET_WARN", "50"))
+)
+
+# Opt-in request profiling, see profiling.py for the PROFILING_* settings
+profiling = profiling_settings()
+if profiling:
+    app.add_middleware(
+        ProfilingMiddleware,
+        is_authorized=lambda authorization: authorization == "Bearer admin_authenticated",
+        **profiling
+    )
+
+# Outermost, so the latency histograms include every other middleware
+app.add_middleware(MetricsMiddleware)
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
 # Configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -716,6 +2228,67 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+# Maintenance commands, e.g. `python server.py indexes --ensure`
+async def indexes_command(args):
+    if args.ensure:
+        await ensure_indexes()
+    for index in await index_report():
+        keys = ", ".join(f"{field}:{direction}" for field, direction in index["keys"])
+        size = "-" if index["size_bytes"] is None else f"{index['size_bytes']}B"
+        unique = " unique" if index["unique"] else ""
+        error = f" -- {index['error']}" if index["error"] else ""
+        print(f"{index['status']:<8} {index['collection']}.{index['name']} ({keys}){unique} {size}{error}")
+
+async def rebuild_rollups_command(args):
+    await rebuild_revenue_rollups()
+    print(f"Rebuilt {await db.revenue_rollups.count_documents({})} revenue rollups")
+
+async def reconcile_command(args):
+    stripe_gateway = create_stripe_gateway()
+    while True:
+        outcomes = await reconcile_stale_transactions(stripe_gateway)
+        print(f"Reconciled transactions: {outcomes}, booked revenue for {await book_unbooked_revenue()}")
+        if args.once:
+            return
+        if outcomes["due"] < RECONCILE_BATCH_SIZE:
+            await asyncio.sleep(RECONCILE_INTERVAL_SECONDS)
+
+async def webhooks_command(args):
+    if args.replay:
+        print(f"Replayed {await replay_failed_webhooks()} failed webhook events")
+        return
+    async for event in db.webhook_inbox.find({"status": "failed"}).sort("received_at", 1):
+        print(f"{event['_id']} {event['event_type']} {event['session_id']} attempts={event['attempts']} -- {event.get('last_error')}")
+
+async def run_command(args):
+    connect_mongo()
+    try:
+        await args.handler(args)
+    finally:
+        close_mongo()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Mystic Services maintenance commands")
+    commands = parser.add_subparsers(dest="command", required=True)
+    
+    indexes_parser = commands.add_parser("indexes", help="Report registry indexes, their status and size")
+    indexes_parser.add_argument("--ensure", action="store_true", help="Create missing indexes first")
+    indexes_parser.set_defaults(handler=indexes_command)
+    
+    rollups_parser = commands.add_parser("rebuild-rollups", help="Recompute revenue_rollups from payment_transactions")
+    rollups_parser.set_defaults(handler=rebuild_rollups_command)
+    
+    reconcile_parser = commands.add_parser("reconcile", help="Reconcile stale open transactions with Stripe")
+    reconcile_parser.add_argument("--once", action="store_true", help="Run a single pass and exit")
+    reconcile_parser.set_defaults(handler=reconcile_command)
+    
+    webhooks_parser = commands.add_parser("failed-webhooks", help="List webhook events that ran out of attempts")
+    webhooks_parser.add_argument("--replay", action="store_true", help="Queue them again with fresh attempts")
+    webhooks_parser.set_defaults(handler=webhooks_command)
+    
+    args = parser.parse_args(argv)
+    asyncio.run(run_command(args))
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+"""Local stand-in for StripeCheckout, used by tests and benchmarks.
+
+Select it with STRIPE_CHECKOUT_BACKEND=stub. Sessions live in memory, every
+call can be delayed by STRIPE_STUB_LATENCY_MS to mimic a network round trip,
+and webhooks are plain JSON bodies with no signature check.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import Dict, Optional
+
+from pydantic import BaseModel
+from emergentintegrations.payments.stripe.checkout import CheckoutSessionResponse, CheckoutStatusResponse
+
+
+class StubWebhookEvent(BaseModel):
+    event_type: str
+    event_id: str
+    created_at: int
+    session_id: str
+    payment_status: str
+    metadata: Dict[str, str] = {}
+
+
+class StubStripeCheckout:
+    def __init__(self, latency_ms: Optional[float] = None):
+        if latency_ms is None:
+            latency_ms = float(os.environ.get("STRIPE_STUB_LATENCY_MS", "0"))
+        self.latency = latency_ms / 1000
+        self.sessions = {}
+        self.calls = 0
+
+    async def _round_trip(self):
+        self.calls += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def create_checkout_session(self, checkout_request):
+        await self._round_trip()
+        session_id = f"cs_test_{uuid.uuid4().hex}"
+        self.sessions[session_id] = {
+            "status": "open",
+            "payment_status": "unpaid",
+            "amount_total": int(round(checkout_request.amount * 100)),
+            "currency": checkout_request.currency,
+            "metadata": dict(checkout_request.metadata or {}),
+        }
+        return CheckoutSessionResponse(url=f"https://checkout.stripe.test/{session_id}", session_id=session_id)
+
+    async def get_checkout_status(self, session_id):
+        await self._round_trip()
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise ValueError(f"No such checkout.session: {session_id}")
+        return CheckoutStatusResponse(**session)
+
+    async def handle_webhook(self, body, signature):
+        await self._round_trip()
+        payload = json.loads(body)
+        payload.setdefault("event_id", f"evt_test_{uuid.uuid4().hex}")
+        payload.setdefault("created_at", int(time.time()))
+        payload.setdefault("payment_status", "paid")
+        return StubWebhookEvent(**payload)
+
+    def complete(self, session_id):
+        """Mark a session as paid, as if the customer finished checkout"""
+        self.sessions[session_id].update(status="complete", payment_status="paid")
+
+    def expire(self, session_id):
+        self.sessions[session_id].update(status="expired")
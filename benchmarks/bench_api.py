@@ -0,0 +1,247 @@
+"""In-process latency benchmark for the API.
+
+Mounts `app` from backend/server.py through httpx's ASGI transport, backed by
+mongomock-motor (or a real mongod with --mongo-url) and the stub Stripe
+checkout, then drives each endpoint at a fixed concurrency and reports
+p50/p95/p99 latency and throughput. Results are saved as JSON so runs can be
+compared with --compare.
+
+Usage:
+    python benchmarks/bench_api.py --concurrency 20 --requests 500 \
+        --output bench-results.json --compare previous.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from itertools import count
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("STRIPE_CHECKOUT_BACKEND", "stub")
+
+import httpx  # noqa: E402
+
+import server  # noqa: E402
+
+ADMIN_HEADERS = {"Authorization": "Bearer admin_authenticated"}
+
+
+def connect(mongo_url):
+    if mongo_url:
+        from motor.motor_asyncio import AsyncIOMotorClient
+
+        return AsyncIOMotorClient(mongo_url)[f"bench_{uuid.uuid4().hex[:8]}"]
+    from mongomock_motor import AsyncMongoMockClient
+
+    return AsyncMongoMockClient()["bench"]
+
+
+async def seed(db, rows):
+    """Insert `rows` paid transactions with client forms, plus consultas and a flyer"""
+    transactions, forms, consultas = [], [], []
+    service_types = list(server.LEGACY_SERVICES)
+    start = date(2030, 1, 1)
+    for i in range(rows):
+        session_id = f"cs_bench_{i}"
+        service_type = service_types[i % len(service_types)]
+        transactions.append(server.PaymentTransaction(
+            session_id=session_id,
+            service_type=service_type,
+            amount=server.LEGACY_SERVICES[service_type]["price"],
+            payment_status=server.PaymentStatus.COMPLETED,
+        ).dict())
+        forms.append(server.ClientForm(
+            payment_session_id=session_id,
+            nome_completo=f"Cliente {i}",
+            data_nascimento="1990-01-01",
+            telefone="11999999999",
+            situacao_atual="benchmark",
+            service_type=service_type,
+        ).dict())
+        slot = server.SLOT_TEMPLATE[i % len(server.SLOT_TEMPLATE)]
+        consultas.append(server.ConsultaAgendamento(
+            nome_completo=f"Cliente {i}",
+            telefone="11999999999",
+            data_consulta=(start + timedelta(days=i // len(server.SLOT_TEMPLATE))).isoformat(),
+            horario=slot,
+        ).dict())
+    if rows:
+        await db.payment_transactions.insert_many(transactions)
+        await db.client_forms.insert_many(forms)
+        await db.consultas.insert_many(consultas)
+    await db.flyers.insert_one(server.FlyerContent(titulo="Benchmark", descricao="Flyer ativo").dict())
+
+
+def build_scenarios(pending_sessions):
+    """name -> callable(client, i) issuing one request"""
+    bookings = count()
+    webhooks = count()
+    far_future = date(2040, 1, 1)
+
+    def book(c, i):
+        n = next(bookings)
+        day = far_future + timedelta(days=n // len(server.SLOT_TEMPLATE))
+        return c.post("/api/consulta/agendar", json={
+            "nome_completo": "Bench",
+            "telefone": "11999999999",
+            "data_consulta": day.isoformat(),
+            "horario": server.SLOT_TEMPLATE[n % len(server.SLOT_TEMPLATE)],
+        })
+
+    def webhook(c, i):
+        session_id = pending_sessions[i % len(pending_sessions)]
+        return c.post("/api/webhook/stripe", json={
+            "event_type": "checkout.session.completed",
+            "event_id": f"evt_bench_{next(webhooks)}",
+            "session_id": session_id,
+        })
+
+    return {
+        "services": lambda c, i: c.get("/api/services"),
+        "flyer_ativo": lambda c, i: c.get("/api/flyer-ativo"),
+        "horarios_dia": lambda c, i: c.get("/api/horarios-disponiveis/2030-01-02"),
+        "horarios_mes": lambda c, i: c.get("/api/horarios-disponiveis", params={"from": "2030-01-01", "to": "2030-01-31"}),
+        "admin_clients": lambda c, i: c.get("/api/admin/clients", headers=ADMIN_HEADERS, params={"limit": 100}),
+        "admin_transactions": lambda c, i: c.get("/api/admin/transactions", headers=ADMIN_HEADERS, params={"limit": 100}),
+        "admin_consultas": lambda c, i: c.get("/api/admin/consultas", headers=ADMIN_HEADERS, params={"limit": 100}),
+        "admin_stats": lambda c, i: c.get("/api/admin/stats", headers=ADMIN_HEADERS),
+        "checkout_session": lambda c, i: c.post(
+            "/api/checkout/session",
+            json={"service_type": "amor", "origin_url": "http://bench"},
+            headers={"Idempotency-Key": uuid.uuid4().hex},
+        ),
+        "checkout_status": lambda c, i: c.get(f"/api/checkout/status/{pending_sessions[i % len(pending_sessions)]}"),
+        "consulta_agendar": book,
+        "webhook": webhook,
+    }
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    rank = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values))) - 1))
+    return sorted_values[rank]
+
+
+async def run_scenario(client, request, total, concurrency):
+    latencies, statuses = [], {}
+    issued = count()
+
+    async def worker():
+        while True:
+            i = next(issued)
+            if i >= total:
+                return
+            started = time.perf_counter()
+            try:
+                response = await request(client, i)
+                status = str(response.status_code)
+            except Exception as e:
+                status = type(e).__name__
+            latencies.append((time.perf_counter() - started) * 1000)
+            statuses[status] = statuses.get(status, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "concurrency": concurrency,
+        "p50_ms": round(percentile(latencies, 50), 3),
+        "p95_ms": round(percentile(latencies, 95), 3),
+        "p99_ms": round(percentile(latencies, 99), 3),
+        "max_ms": round(latencies[-1], 3),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "statuses": statuses,
+    }
+
+
+def print_results(results, baseline=None):
+    header = f"{'endpoint':<20} {'p50':>9} {'p95':>9} {'p99':>9} {'rps':>9}  statuses"
+    print(header)
+    print("-" * len(header))
+    for name, result in results.items():
+        line = (f"{name:<20} {result['p50_ms']:>9.2f} {result['p95_ms']:>9.2f} "
+                f"{result['p99_ms']:>9.2f} {result['throughput_rps']:>9.1f}  {result['statuses']}")
+        previous = (baseline or {}).get(name)
+        if previous:
+            def delta(key):
+                return (result[key] - previous[key]) / previous[key] * 100 if previous[key] else 0.0
+            line += f"  (p50 {delta('p50_ms'):+.0f}%, p99 {delta('p99_ms'):+.0f}%, rps {delta('throughput_rps'):+.0f}%)"
+        print(line)
+
+
+async def main(args):
+    db = connect(args.mongo_url)
+    server.db = db
+    server.app.state.stripe_gateway = server.create_stripe_gateway()
+    await server.run_startup_stages()
+    await seed(db, args.rows)
+
+    scenarios = build_scenarios(pending_sessions=[])
+    selected = args.endpoints or list(scenarios)
+    unknown = set(selected) - set(scenarios)
+    if unknown:
+        raise SystemExit(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        pending_sessions = []
+        for _ in range(min(args.requests, 200)):
+            response = await client.post(
+                "/api/checkout/session",
+                json={"service_type": "amor", "origin_url": "http://bench"},
+                headers={"Idempotency-Key": uuid.uuid4().hex},
+            )
+            pending_sessions.append(response.json()["session_id"])
+        scenarios = build_scenarios(pending_sessions)
+
+        results = {}
+        for name in selected:
+            for i in range(args.warmup):
+                await scenarios[name](client, i)
+            results[name] = await run_scenario(client, scenarios[name], args.requests, args.concurrency)
+
+    if args.mongo_url:
+        await db.client.drop_database(db.name)
+
+    baseline = None
+    if args.compare:
+        baseline = json.loads(Path(args.compare).read_text())["results"]
+    print_results(results, baseline)
+
+    if args.output:
+        Path(args.output).write_text(json.dumps({
+            "meta": {
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "concurrency": args.concurrency,
+                "requests": args.requests,
+                "rows": args.rows,
+                "mongo": args.mongo_url or "mongomock",
+                "stripe_latency_ms": float(os.environ.get("STRIPE_STUB_LATENCY_MS", "0")),
+                "python": platform.python_version(),
+            },
+            "results": results,
+        }, indent=2))
+        print(f"Saved results to {args.output}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="In-process API latency benchmark")
+    parser.add_argument("--concurrency", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=300, help="Requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=5, help="Untimed requests per endpoint")
+    parser.add_argument("--rows", type=int, default=1000, help="Transactions/clients/consultas to seed")
+    parser.add_argument("--endpoints", nargs="*", help="Subset of endpoints to run")
+    parser.add_argument("--mongo-url", help="Use a real mongod (a throwaway database is created and dropped)")
+    parser.add_argument("--output", help="Write JSON results here")
+    parser.add_argument("--compare", help="Previous JSON results to diff against")
+    asyncio.run(main(parser.parse_args()))
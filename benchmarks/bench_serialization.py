@@ -0,0 +1,88 @@
+"""Compare the two admin response paths on a 1000-document payload.
+
+legacy: full documents with ObjectId _id -> serialize_mongo_data ->
+        jsonable_encoder -> JSONResponse (what FastAPI does for a returned dict)
+fast:   documents read with an _id-free projection -> FastJSONResponse (orjson)
+
+Usage: python benchmarks/bench_serialization.py [--documents 1000] [--repeat 200]
+"""
+import argparse
+import statistics
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+from bson import ObjectId  # noqa: E402
+from fastapi.encoders import jsonable_encoder  # noqa: E402
+from fastapi.responses import JSONResponse  # noqa: E402
+
+import server  # noqa: E402
+
+
+def make_documents(count):
+    created = datetime(2024, 1, 1, tzinfo=timezone.utc).replace(tzinfo=None)
+    documents = []
+    for i in range(count):
+        documents.append({
+            "_id": ObjectId(),
+            "id": str(uuid.uuid4()),
+            "payment_session_id": f"cs_live_{uuid.uuid4().hex}",
+            "nome_completo": f"Cliente {i}",
+            "data_nascimento": "1990-01-01",
+            "telefone": "11999999999",
+            "nome_pessoa_amada": "Pessoa Amada",
+            "situacao_atual": "Situação atual descrita pelo cliente " * 3,
+            "observacoes": None,
+            "service_type": "amor",
+            "video_links": [
+                {"url": "https://example.com/v.mp4", "title": "Vídeo", "description": None, "sent_at": created},
+            ],
+            "status": "pendente",
+            "created_at": created + timedelta(minutes=i),
+            "payment_info": {"amount": 297.0, "payment_status": "completed", "service_name": "Ritual de Amor"},
+        })
+    return documents
+
+
+def legacy_path(documents):
+    content = {"clients": server.serialize_mongo_data(documents), "next_cursor": None}
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def fast_path(documents):
+    return server.FastJSONResponse({"clients": documents, "next_cursor": None}).body
+
+
+def measure(func, documents, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        func(documents)
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings), min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    documents = make_documents(args.documents)
+    projected = [{k: v for k, v in d.items() if k != "_id"} for d in documents]
+
+    legacy_median, legacy_min = measure(legacy_path, documents, args.repeat)
+    fast_median, fast_min = measure(fast_path, projected, args.repeat)
+
+    print(f"{args.documents} documents, {args.repeat} runs")
+    print(f"legacy  median {legacy_median:8.3f}ms  min {legacy_min:8.3f}ms")
+    print(f"fast    median {fast_median:8.3f}ms  min {fast_min:8.3f}ms")
+    print(f"speedup {legacy_median / fast_median:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -286,6 +286,10 @@ const Payment = () => {
   const [service, setService] = useState(null);
   const [loading, setLoading] = useState(false);
   const [error, setError] = useState("");
+  // One key per visit: double-clicks and retries reuse the same Stripe session
+  const [checkoutKey] = useState(() =>
+    window.crypto?.randomUUID ? window.crypto.randomUUID() : `${Date.now()}-${Math.random().toString(36).slice(2)}`
+  );
   
   const serviceKey = location.pathname.split('/')[2];
 
@@ -317,6 +321,8 @@ const Payment = () => {
       const response = await axios.post(`${API}/checkout/session`, {
         service_type: serviceKey,
         origin_url: originUrl
+      }, {
+        headers: { "Idempotency-Key": `${checkoutKey}:${serviceKey}` }
       });
       
       if (response.data.url) {
@@ -429,12 +435,46 @@ const Success = () => {
     const session_id = params.get('session_id');
     if (session_id) {
       setSessionId(session_id);
-      checkPaymentStatus(session_id);
+      return watchPaymentStatus(session_id);
     } else {
       navigate('/');
     }
   }, [location, navigate]);
 
+  const applyPaymentStatus = (data) => {
+    if (data.payment_status === 'paid') {
+      setPaymentStatus("completed");
+      setServiceType(data.metadata?.service_type || "");
+      return true;
+    }
+    if (data.status === 'expired') {
+      setPaymentStatus("expired");
+      return true;
+    }
+    return false;
+  };
+
+  // The server pushes status changes over one SSE connection; polling is
+  // only the fallback for browsers or proxies where EventSource fails
+  const watchPaymentStatus = (session_id) => {
+    if (typeof EventSource === "undefined") {
+      checkPaymentStatus(session_id);
+      return undefined;
+    }
+    const events = new EventSource(`${API}/checkout/events/${session_id}`);
+    events.addEventListener("status", (event) => {
+      if (applyPaymentStatus(JSON.parse(event.data))) {
+        events.close();
+      }
+    });
+    events.onerror = () => {
+      if (events.readyState === EventSource.CLOSED) {
+        checkPaymentStatus(session_id);
+      }
+    };
+    return () => events.close();
+  };
+
   const checkPaymentStatus = async (session_id, attempts = 0) => {
     const maxAttempts = 10;
     
@@ -446,12 +486,7 @@ const Success = () => {
     try {
       const response = await axios.get(`${API}/checkout/status/${session_id}`);
       
-      if (response.data.payment_status === 'paid') {
-        setPaymentStatus("completed");
-        setServiceType(response.data.metadata?.service_type || "");
-      } else if (response.data.status === 'expired') {
-        setPaymentStatus("expired");
-      } else {
+      if (!applyPaymentStatus(response.data)) {
         // Continue polling
         setTimeout(() => checkPaymentStatus(session_id, attempts + 1), 2000);
       }
@@ -922,31 +957,36 @@ const Admin = () => {
     }
   };
 
+  // Admin lists are served in pages; follow next_cursor until the last one
+  const fetchAllPages = async (path, key) => {
+    const items = [];
+    let cursor = null;
+    do {
+      const response = await axios.get(`${API}${path}`, {
+        headers: { Authorization: 'Bearer admin_authenticated' },
+        params: cursor ? { cursor } : {}
+      });
+      items.push(...(response.data[key] || []));
+      cursor = response.data.next_cursor;
+    } while (cursor);
+    return items;
+  };
+
   const fetchAdminData = async () => {
     try {
-      const [clientsRes, transactionsRes, consultasRes, flyersRes, rituaisRes] = await Promise.all([
-        axios.get(`${API}/admin/clients`, { 
-          headers: { Authorization: 'Bearer admin_authenticated' } 
-        }),
-        axios.get(`${API}/admin/transactions`, { 
-          headers: { Authorization: 'Bearer admin_authenticated' } 
-        }),
-        axios.get(`${API}/admin/consultas`, { 
-          headers: { Authorization: 'Bearer admin_authenticated' } 
-        }),
-        axios.get(`${API}/admin/flyers`, { 
-          headers: { Authorization: 'Bearer admin_authenticated' } 
-        }),
-        axios.get(`${API}/admin/rituais`, { 
-          headers: { Authorization: 'Bearer admin_authenticated' } 
-        })
+      const [allClients, allTransactions, allConsultas, allFlyers, allRituais] = await Promise.all([
+        fetchAllPages('/admin/clients', 'clients'),
+        fetchAllPages('/admin/transactions', 'transactions'),
+        fetchAllPages('/admin/consultas', 'consultas'),
+        fetchAllPages('/admin/flyers', 'flyers'),
+        fetchAllPages('/admin/rituais', 'rituais')
       ]);
       
-      setClients(clientsRes.data.clients);
-      setTransactions(transactionsRes.data.transactions);
-      setConsultas(consultasRes.data.consultas || []);
-      setFlyers(flyersRes.data.flyers || []);
-      setRituais(rituaisRes.data.rituais || []);
+      setClients(allClients);
+      setTransactions(allTransactions);
+      setConsultas(allConsultas);
+      setFlyers(allFlyers);
+      setRituais(allRituais);
       setLoading(false);
     } catch (error) {
       setError("Erro ao carregar dados");
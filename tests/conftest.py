@@ -0,0 +1,112 @@
+import os
+import sys
+from collections import Counter
+from pathlib import Path
+
+import pytest
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+if str(BACKEND_DIR) not in sys.path:
+    sys.path.insert(0, str(BACKEND_DIR))
+
+# Report per-request Mongo/Stripe call counts as response headers
+os.environ.setdefault("QUERY_BUDGET_HEADERS", "1")
+
+ADMIN_HEADERS = {"Authorization": "Bearer admin_authenticated"}
+
+# Collection methods that issue a command against the server
+QUERY_METHODS = {
+    "find", "find_one", "find_one_and_update", "aggregate", "count_documents",
+    "insert_one", "insert_many", "update_one", "update_many", "delete_one",
+    "delete_many", "bulk_write",
+}
+
+
+class CountingCollection:
+    """Wrap a mongomock collection and count the commands issued through it"""
+
+    def __init__(self, collection, counter):
+        self._collection = collection
+        self._counter = counter
+
+    def __getattr__(self, name):
+        attr = getattr(self._collection, name)
+        if name not in QUERY_METHODS:
+            return attr
+
+        def counted(*args, **kwargs):
+            # mongomock has no command monitoring, so feed the app's
+            # per-request query budget from here
+            from metrics import record_mongo_command
+
+            self._counter[(self._collection.name, name)] += 1
+            record_mongo_command(self._collection.name, name)
+            return attr(*args, **kwargs)
+
+        return counted
+
+
+class CountingDatabase:
+    def __init__(self, database):
+        self._database = database
+        self.queries = Counter()
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            return getattr(self._database, name)
+        return self.get_collection(name)
+
+    def __getitem__(self, name):
+        return self.get_collection(name)
+
+    def get_collection(self, name, **options):
+        return CountingCollection(self._database.get_collection(name, **options), self.queries)
+
+    def reset(self):
+        self.queries.clear()
+
+    @property
+    def total(self):
+        return sum(self.queries.values())
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def server(monkeypatch):
+    server = pytest.importorskip("server")
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    db = CountingDatabase(mongomock_motor.AsyncMongoMockClient()["test_database"])
+    monkeypatch.setattr(server, "db", db)
+    server.services_cache.invalidate()
+    server.active_flyer_cache.invalidate()
+    monkeypatch.setattr(server, "slot_cache", server.SlotOccupancyCache(server.SLOT_CACHE_TTL_SECONDS))
+    return server
+
+
+@pytest.fixture
+def stripe_stub(server, monkeypatch):
+    from stripe_stub import StubStripeCheckout
+
+    stub = StubStripeCheckout(latency_ms=0)
+    monkeypatch.setattr(server.app.state, "stripe_gateway", server.StripeGateway(lambda webhook_url: stub), raising=False)
+    return stub
+
+
+@pytest.fixture
+async def api(server, stripe_stub):
+    httpx = pytest.importorskip("httpx")
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+def assert_query_budget(response, max_mongo, max_stripe=0):
+    """Fail when a response used more Mongo commands or Stripe calls than allowed"""
+    mongo = int(response.headers["x-mongo-queries"])
+    stripe = int(response.headers["x-stripe-calls"])
+    assert mongo <= max_mongo, f"{response.request.url.path} issued {mongo} Mongo commands (budget {max_mongo})"
+    assert stripe <= max_stripe, f"{response.request.url.path} made {stripe} Stripe calls (budget {max_stripe})"
@@ -0,0 +1,73 @@
+import uuid
+
+import pytest
+
+from tests.conftest import ADMIN_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+
+async def seed_clients(server, count, service_types=("amor", "protecao", "ritual-novo")):
+    await server.db.rituais.update_one(
+        {"id": "ritual-novo"},
+        {"$set": {"id": "ritual-novo", "name": "Ritual Novo", "active": True}},
+        upsert=True,
+    )
+    for i in range(count):
+        session_id = f"cs_{uuid.uuid4().hex}"
+        service_type = service_types[i % len(service_types)]
+        transaction = server.PaymentTransaction(
+            session_id=session_id,
+            service_type=service_type,
+            amount=100.0 + i,
+            payment_status=server.PaymentStatus.COMPLETED,
+        )
+        await server.db.payment_transactions.insert_one(transaction.dict())
+        form = server.ClientForm(
+            payment_session_id=session_id,
+            nome_completo=f"Cliente {i}",
+            data_nascimento="1990-01-01",
+            telefone="11999999999",
+            situacao_atual="teste",
+            service_type=service_type,
+        )
+        await server.db.client_forms.insert_one(form.dict())
+
+
+async def test_get_clients_builds_payment_info(server, api):
+    await seed_clients(server, 3)
+
+    response = await api.get("/api/admin/clients", headers=ADMIN_HEADERS)
+
+    assert response.status_code == 200
+    names = {c["payment_info"]["service_name"] for c in response.json()["clients"]}
+    assert names == {"Ritual de Amor", "Ritual de Proteção", "Ritual Novo"}
+
+
+async def test_get_clients_query_count_is_flat(server, api):
+    await seed_clients(server, 3)
+    server.db.reset()
+    response = await api.get("/api/admin/clients", headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    small = server.db.total
+
+    await seed_clients(server, 60)
+    server.db.reset()
+    response = await api.get("/api/admin/clients", headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    assert len(response.json()["clients"]) == 63
+
+    assert server.db.total == small <= 3
+
+
+async def test_get_transactions_resolves_names_in_one_query(server, api):
+    await seed_clients(server, 30)
+    server.db.reset()
+
+    response = await api.get("/api/admin/transactions", headers=ADMIN_HEADERS)
+
+    assert response.status_code == 200
+    names = {t["metadata"]["service_name"] for t in response.json()["transactions"]}
+    assert names == {"Ritual de Amor", "Ritual de Proteção", "Ritual Novo"}
+    assert server.db.queries[("rituais", "find")] == 1
+    assert server.db.total == 2
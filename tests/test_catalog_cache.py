@@ -0,0 +1,66 @@
+import asyncio
+
+import pytest
+
+from tests.conftest import ADMIN_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+RITUAL = {
+    "name": "Ritual da Lua",
+    "description": "Ritual de teste",
+    "price": 150.0,
+    "duration": "7 dias",
+    "image": "https://example.com/lua.jpg",
+    "category": "amor",
+}
+
+
+async def test_services_etag_and_not_modified(server, api):
+    first = await api.get("/api/services")
+    etag = first.headers["etag"]
+
+    again = await api.get("/api/services")
+    not_modified = await api.get("/api/services", headers={"If-None-Match": etag})
+
+    assert again.headers["etag"] == etag
+    assert not_modified.status_code == 304
+    assert not_modified.content == b""
+    assert (await api.get("/api/services", headers={"If-None-Match": '"stale"'})).status_code == 200
+
+
+async def test_services_follow_ritual_create_update_delete(server, api):
+    etags = [(await api.get("/api/services")).headers["etag"]]
+
+    created = await api.post("/api/admin/rituais", json=RITUAL, headers=ADMIN_HEADERS)
+    ritual_id = created.json()["ritual_id"]
+    response = await api.get("/api/services")
+    assert response.json()["services"][ritual_id]["price"] == 150.0
+    etags.append(response.headers["etag"])
+
+    await api.put(f"/api/admin/rituais/{ritual_id}", json={"price": 180.0}, headers=ADMIN_HEADERS)
+    response = await api.get("/api/services")
+    assert response.json()["services"][ritual_id]["price"] == 180.0
+    etags.append(response.headers["etag"])
+
+    await api.delete(f"/api/admin/rituais/{ritual_id}", headers=ADMIN_HEADERS)
+    response = await api.get("/api/services")
+    assert ritual_id not in response.json()["services"]
+    etags.append(response.headers["etag"])
+
+    # The ETag is a content hash, so deleting the ritual restores the first one
+    assert len(set(etags[:3])) == 3
+    assert etags[3] == etags[0]
+
+
+async def test_services_pick_up_edits_from_other_workers_after_ttl(server, api, monkeypatch):
+    monkeypatch.setattr(server.services_cache, "ttl_seconds", 0.05)
+    before = await api.get("/api/services")
+
+    # A write made by another worker does not invalidate this one's cache
+    await server.db.rituais.insert_one({**RITUAL, "id": "ritual-remoto", "active": True})
+    assert (await api.get("/api/services")).headers["etag"] == before.headers["etag"]
+
+    await asyncio.sleep(0.06)
+    after = await api.get("/api/services")
+    assert "ritual-remoto" in after.json()["services"]
@@ -0,0 +1,399 @@
+import asyncio
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def create_session(api, service_type="amor", idempotency_key=None):
+    response = await api.post(
+        "/api/checkout/session",
+        json={"service_type": service_type, "origin_url": "http://test"},
+        headers={"Idempotency-Key": idempotency_key or uuid.uuid4().hex},
+    )
+    assert response.status_code == 200
+    return response.json()["session_id"]
+
+
+async def test_concurrent_status_polls_share_one_stripe_call(server, api, stripe_stub):
+    session_id = await create_session(api)
+    stripe_stub.latency = 0.05
+    stripe_stub.calls = 0
+
+    responses = await asyncio.gather(*(api.get(f"/api/checkout/status/{session_id}") for _ in range(20)))
+
+    assert {r.json()["payment_status"] for r in responses} == {"unpaid"}
+    assert stripe_stub.calls == 1
+
+
+async def test_terminal_transaction_is_answered_from_mongo(server, api, stripe_stub, monkeypatch):
+    monkeypatch.setattr(server.checkout_status_cache, "ttl_seconds", 0)
+    session_id = await create_session(api)
+    stripe_stub.complete(session_id)
+
+    first = await api.get(f"/api/checkout/status/{session_id}")
+    calls = stripe_stub.calls
+    second = await api.get(f"/api/checkout/status/{session_id}")
+
+    assert first.json() == second.json()
+    assert second.json()["payment_status"] == "paid"
+    assert stripe_stub.calls == calls
+
+
+async def test_webhook_is_queued_once_and_applied_by_the_worker(server, api):
+    session_id = await create_session(api)
+    event = {"event_type": "checkout.session.completed", "event_id": "evt_1", "session_id": session_id}
+
+    for _ in range(3):
+        response = await api.post("/api/webhook/stripe", json=event)
+        assert response.status_code == 200
+
+    assert await server.db.webhook_inbox.count_documents({}) == 1
+    transaction = await server.db.payment_transactions.find_one({"session_id": session_id})
+    assert transaction["payment_status"] == server.PaymentStatus.INITIATED
+
+    assert await server.webhook_worker.process_batch() == 1
+    assert await server.webhook_worker.process_batch() == 0
+
+    transaction = await server.db.payment_transactions.find_one({"session_id": session_id})
+    assert transaction["payment_status"] == server.PaymentStatus.COMPLETED
+    assert (await server.db.webhook_inbox.find_one({"_id": "evt_1"}))["status"] == "done"
+
+
+async def expire_webhook_leases(server):
+    expired = datetime.now(timezone.utc) - timedelta(seconds=server.WEBHOOK_LEASE_SECONDS + 1)
+    await server.db.webhook_inbox.update_many({"status": "processing"}, {"$set": {"locked_at": expired}})
+
+
+async def test_webhook_that_keeps_failing_is_marked_failed_and_replayable(server, api, monkeypatch):
+    monkeypatch.setattr(server, "WEBHOOK_MAX_ATTEMPTS", 2)
+    complete = server.complete_transaction
+    ok_session, bad_session = await create_session(api), await create_session(api)
+
+    async def flaky(session_id, extra_fields=None):
+        if session_id == bad_session:
+            raise RuntimeError("mongo unavailable")
+        return await complete(session_id, extra_fields)
+
+    monkeypatch.setattr(server, "complete_transaction", flaky)
+    for event_id, session_id in [("evt_ok", ok_session), ("evt_bad", bad_session)]:
+        await api.post("/api/webhook/stripe", json={
+            "event_type": "checkout.session.completed", "event_id": event_id, "session_id": session_id,
+        })
+
+    assert await server.webhook_worker.process_batch() == 2
+    assert (await server.db.webhook_inbox.find_one({"_id": "evt_ok"}))["status"] == "done"
+    retrying = await server.db.webhook_inbox.find_one({"_id": "evt_bad"})
+    assert retrying["status"] == "processing"
+    assert retrying["last_error"] == "RuntimeError: mongo unavailable"
+
+    await expire_webhook_leases(server)
+    assert await server.webhook_worker.process_batch() == 1
+    failed = await server.db.webhook_inbox.find_one({"_id": "evt_bad"})
+    assert failed["status"] == "failed"
+    assert failed["attempts"] == 2
+    assert "lock_token" not in failed
+
+    await expire_webhook_leases(server)
+    assert await server.webhook_worker.process_batch() == 0
+
+    monkeypatch.setattr(server, "complete_transaction", complete)
+    assert await server.replay_failed_webhooks() == 1
+    assert await server.webhook_worker.process_batch() == 1
+    assert (await server.db.webhook_inbox.find_one({"_id": "evt_bad"}))["status"] == "done"
+    transaction = await server.db.payment_transactions.find_one({"session_id": bad_session})
+    assert transaction["payment_status"] == server.PaymentStatus.COMPLETED
+
+
+async def test_webhook_abandoned_on_its_last_attempt_is_marked_failed(server, monkeypatch):
+    monkeypatch.setattr(server, "WEBHOOK_MAX_ATTEMPTS", 1)
+    await server.db.webhook_inbox.insert_one({
+        "_id": "evt_dead", "event_type": "checkout.session.completed", "session_id": "cs_dead",
+        "status": "processing", "attempts": 1, "lock_token": "dead-worker",
+        "locked_at": datetime.now(timezone.utc) - timedelta(seconds=server.WEBHOOK_LEASE_SECONDS + 1),
+        "received_at": datetime.now(timezone.utc),
+    })
+
+    assert await server.webhook_worker.process_batch() == 0
+
+    failed = await server.db.webhook_inbox.find_one({"_id": "evt_dead"})
+    assert failed["status"] == "failed"
+    assert failed["last_error"] == "Lease expired on the last attempt"
+
+
+async def test_revenue_is_booked_once_per_completed_transaction(server, api, stripe_stub, monkeypatch):
+    monkeypatch.setattr(server.checkout_status_cache, "ttl_seconds", 0)
+    session_id = await create_session(api)
+    stripe_stub.complete(session_id)
+
+    await api.get(f"/api/checkout/status/{session_id}")
+    await api.post("/api/webhook/stripe", json={
+        "event_type": "checkout.session.completed", "event_id": "evt_2", "session_id": session_id,
+    })
+    await server.webhook_worker.process_batch()
+
+    response = await api.get("/api/admin/stats", headers={"Authorization": "Bearer admin_authenticated"})
+    assert response.json()["total"] == {"count": 1, "amount": 297.0}
+
+    await server.rebuild_revenue_rollups()
+    rebuilt = await api.get("/api/admin/stats", headers={"Authorization": "Bearer admin_authenticated"})
+    assert rebuilt.json() == response.json()
+
+
+async def test_reconciler_settles_abandoned_transactions(server, api, stripe_stub):
+    paid, expired, fresh = [await create_session(api) for _ in range(3)]
+    stripe_stub.complete(paid)
+    stripe_stub.expire(expired)
+    await server.db.payment_transactions.update_many(
+        {"session_id": {"$in": [paid, expired]}},
+        {"$set": {"reconcile_after": server.datetime.now(server.timezone.utc)}},
+    )
+    stripe_stub.calls = 0
+
+    outcomes = await server.reconcile_stale_transactions(server.app.state.stripe_gateway)
+
+    assert outcomes == {"due": 2, "checked": 2, "completed": 1, "expired": 1, "open": 0, "errors": 0}
+    assert stripe_stub.calls == 2
+    statuses = {
+        t["session_id"]: t["payment_status"]
+        async for t in server.db.payment_transactions.find({}, {"session_id": 1, "payment_status": 1})
+    }
+    assert statuses == {
+        paid: server.PaymentStatus.COMPLETED,
+        expired: server.PaymentStatus.EXPIRED,
+        fresh: server.PaymentStatus.INITIATED,
+    }
+    assert (await server.reconcile_stale_transactions(server.app.state.stripe_gateway))["checked"] == 0
+
+
+async def test_reconciler_only_skips_the_sleep_after_a_full_batch(server, api, stripe_stub, monkeypatch):
+    monkeypatch.setattr(server, "RECONCILE_BATCH_SIZE", 2)
+    sessions = [await create_session(api) for _ in range(3)]
+    await server.db.payment_transactions.update_many(
+        {"session_id": {"$in": sessions}},
+        {"$set": {"reconcile_after": server.datetime.now(server.timezone.utc)}},
+    )
+    reconcile = server.reconcile_stale_transactions
+    passes = []
+
+    async def recorded(stripe_gateway):
+        outcomes = await reconcile(stripe_gateway)
+        passes.append(outcomes["due"])
+        return outcomes
+
+    monkeypatch.setattr(server, "reconcile_stale_transactions", recorded)
+    reconciler = server.TransactionReconciler(interval_seconds=60)
+    reconciler.start(server.app.state.stripe_gateway)
+    await asyncio.sleep(0.1)
+    await reconciler.stop()
+
+    # The full first batch is followed straight away by the rest, then it sleeps
+    assert passes == [2, 1]
+
+
+async def test_status_events_push_the_webhook_transition(server, api, monkeypatch):
+    monkeypatch.setattr(server, "CHECKOUT_EVENTS_HEARTBEAT_SECONDS", 5)
+    session_id = await create_session(api)
+
+    stream = asyncio.create_task(api.get(f"/api/checkout/events/{session_id}"))
+    while session_id not in server.checkout_events._subscribers:
+        await asyncio.sleep(0)
+    await api.post("/api/webhook/stripe", json={
+        "event_type": "checkout.session.completed", "event_id": "evt_3", "session_id": session_id,
+    })
+    await server.webhook_worker.process_batch()
+    response = await asyncio.wait_for(stream, 1)
+
+    assert response.headers["content-type"].startswith("text/event-stream")
+    events = [json.loads(line[len("data: "):]) for line in response.text.splitlines() if line.startswith("data: ")]
+    assert [e["payment_status"] for e in events] == ["unpaid", "paid"]
+    assert session_id not in server.checkout_events._subscribers
+
+
+async def test_status_events_for_unknown_session(api):
+    response = await api.get("/api/checkout/events/cs_missing")
+    assert response.status_code == 404
+
+
+async def test_checkout_retries_reuse_the_first_session(server, api, stripe_stub):
+    stripe_stub.latency = 0.05
+
+    concurrent = await asyncio.gather(*(create_session(api, idempotency_key="order-1") for _ in range(5)))
+    retried = await create_session(api, idempotency_key="order-1")
+
+    assert set(concurrent) == {retried}
+    assert stripe_stub.calls == 1
+    assert await server.db.payment_transactions.count_documents({}) == 1
+
+    conflict = await api.post(
+        "/api/checkout/session",
+        json={"service_type": "carreira", "origin_url": "http://test"},
+        headers={"Idempotency-Key": "order-1"},
+    )
+    assert conflict.status_code == 409
+
+
+async def test_keyless_checkouts_are_not_deduplicated_by_default(server, api, stripe_stub):
+    body = {"service_type": "amor", "origin_url": "http://test"}
+
+    first, second = [await api.post("/api/checkout/session", json=body) for _ in range(2)]
+
+    assert first.json()["session_id"] != second.json()["session_id"]
+    assert await server.db.checkout_idempotency.count_documents({}) == 0
+
+
+async def test_double_click_without_key_creates_one_session_when_opted_in(server, api, stripe_stub, monkeypatch):
+    monkeypatch.setattr(server, "CHECKOUT_DERIVED_KEY_SECONDS", 10)
+    body = {"service_type": "amor", "origin_url": "http://test"}
+
+    first, second = [await api.post("/api/checkout/session", json=body) for _ in range(2)]
+
+    assert first.json() == second.json()
+    assert stripe_stub.calls == 1
+
+
+async def test_pending_key_holds_a_short_lease_until_done(server, api, stripe_stub):
+    await create_session(api, idempotency_key="order-3")
+
+    stored = await server.db.checkout_idempotency.find_one({})
+    window = stored["expires_at"] - stored["created_at"]
+    assert stored["status"] == "done"
+    assert window.total_seconds() > server.CHECKOUT_IDEMPOTENCY_LEASE_SECONDS
+
+
+async def test_stale_pending_key_is_taken_over(server, api, stripe_stub):
+    key, fingerprint, _ = server.checkout_idempotency_key(
+        server.CheckoutRequest(service_type="amor", origin_url="http://test"), None, "order-4"
+    )
+    # Placeholder left by a worker that died while talking to Stripe
+    now = datetime.now(timezone.utc)
+    await server.db.checkout_idempotency.insert_one({
+        "_id": key,
+        "fingerprint": fingerprint,
+        "status": "pending",
+        "claim_id": "crashed",
+        "created_at": now - timedelta(seconds=60),
+        "expires_at": now - timedelta(seconds=1),
+    })
+
+    session_id = await create_session(api, idempotency_key="order-4")
+
+    stored = await server.db.checkout_idempotency.find_one({"_id": key})
+    assert stored["status"] == "done"
+    assert stored["response"]["session_id"] == session_id
+    assert stripe_stub.calls == 1
+
+
+async def test_slow_stripe_call_keeps_its_lease(server, stripe_stub, monkeypatch):
+    monkeypatch.setattr(server, "CHECKOUT_IDEMPOTENCY_LEASE_SECONDS", 0.06)
+    monkeypatch.setattr(server, "CHECKOUT_IDEMPOTENCY_POLL_SECONDS", 0.01)
+    stripe_stub.latency = 0.2
+    checkout_request = server.CheckoutRequest(service_type="amor", origin_url="http://test")
+    key, fingerprint, ttl_seconds = server.checkout_idempotency_key(checkout_request, None, "order-5")
+    gateway = server.app.state.stripe_gateway
+
+    first = asyncio.create_task(server.create_checkout_once(key, fingerprint, ttl_seconds, checkout_request, gateway))
+    await asyncio.sleep(0.1)
+    # A retry landing on another worker after the initial lease would have run out
+    retried = await server.create_checkout_once(key, fingerprint, ttl_seconds, checkout_request, gateway)
+
+    assert retried == await first
+    assert stripe_stub.calls == 1
+    assert await server.db.payment_transactions.count_documents({}) == 1
+
+
+async def test_failed_checkout_releases_the_key(server, api, stripe_stub, monkeypatch):
+    create = stripe_stub.create_checkout_session
+
+    async def unavailable(checkout_request):
+        raise RuntimeError("stripe unavailable")
+
+    monkeypatch.setattr(stripe_stub, "create_checkout_session", unavailable)
+    failed = await api.post(
+        "/api/checkout/session",
+        json={"service_type": "amor", "origin_url": "http://test"},
+        headers={"Idempotency-Key": "order-2"},
+    )
+    assert failed.status_code == 500
+    assert await server.db.checkout_idempotency.count_documents({}) == 0
+
+    monkeypatch.setattr(stripe_stub, "create_checkout_session", create)
+    assert await create_session(api, idempotency_key="order-2")
+
+
+async def test_status_polls_only_write_on_transitions(server, api, stripe_stub, monkeypatch):
+    monkeypatch.setattr(server.checkout_status_cache, "ttl_seconds", 0)
+    session_id = await create_session(api)
+
+    await api.get(f"/api/checkout/status/{session_id}")
+    pending = await server.db.payment_transactions.find_one({"session_id": session_id})
+    await api.get(f"/api/checkout/status/{session_id}")
+    unchanged = await server.db.payment_transactions.find_one({"session_id": session_id})
+
+    assert pending["payment_status"] == server.PaymentStatus.PENDING
+    assert unchanged == pending
+    assert set(pending["status_timestamps"]) == {"initiated", "pending"}
+
+    stripe_stub.expire(session_id)
+    await api.get(f"/api/checkout/status/{session_id}")
+    await server.complete_transaction(session_id)
+
+    expired = await server.db.payment_transactions.find_one({"session_id": session_id})
+    assert expired["payment_status"] == server.PaymentStatus.EXPIRED
+    assert set(expired["status_timestamps"]) == {"initiated", "pending", "expired"}
+    assert await server.db.revenue_rollups.count_documents({}) == 0
+
+
+async def test_revenue_left_unbooked_by_a_crash_is_booked_once(server, api):
+    session_id = await create_session(api)
+    completed_at = server.datetime.now(server.timezone.utc) - server.timedelta(minutes=5)
+    # The process died between the COMPLETED flip and the rollup increment
+    await server.transition_transaction(
+        session_id, server.PaymentStatus.COMPLETED, {"completed_at": completed_at, "revenue_booked": False}, now=completed_at
+    )
+
+    assert await server.book_unbooked_revenue() == 1
+    assert await server.book_unbooked_revenue() == 0
+    await server.record_revenue(session_id, "amor", 297.0, completed_at)
+
+    response = await api.get("/api/admin/stats", headers={"Authorization": "Bearer admin_authenticated"})
+    assert response.json()["total"] == {"count": 1, "amount": 297.0}
+    assert "sessions" not in response.json()["by_service"]["amor"]
+
+
+async def test_first_of_day_completions_racing_on_the_rollup_insert_both_count(server, api, monkeypatch):
+    first, second = await create_session(api), await create_session(api)
+    completed_at = datetime.now(timezone.utc)
+    get_collection = server.db.get_collection
+    raced = []
+
+    class LosesTheInsertRace:
+        def __init__(self, collection):
+            self._collection = collection
+
+        def __getattr__(self, name):
+            return getattr(self._collection, name)
+
+        async def update_one(self, query, update, upsert=False):
+            if upsert and not raced:
+                raced.append(query)
+                # The other session's upsert inserts the day's rollup first
+                await server.record_revenue(first, "amor", 297.0, completed_at)
+                raise server.DuplicateKeyError("E11000 duplicate key error")
+            return await self._collection.update_one(query, update, upsert=upsert)
+
+    def spy(name, **options):
+        collection = get_collection(name, **options)
+        return LosesTheInsertRace(collection) if name == "revenue_rollups" and not raced else collection
+
+    monkeypatch.setattr(server.db, "get_collection", spy, raising=False)
+    await server.record_revenue(second, "amor", 297.0, completed_at)
+
+    assert raced
+    [rollup] = await server.db.revenue_rollups.find({}).to_list(None)
+    assert (rollup["count"], rollup["amount"]) == (2, 594.0)
+    assert sorted(rollup["sessions"]) == sorted([first, second])
+    assert await server.db.payment_transactions.count_documents({"revenue_booked": True}) == 2
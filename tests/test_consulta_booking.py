@@ -0,0 +1,54 @@
+import asyncio
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+BOOKINGS = 200
+
+
+async def test_concurrent_bookings_for_one_slot_book_exactly_once(server, api):
+    await server.ensure_indexes()
+
+    async def book(i):
+        return await api.post("/api/consulta/agendar", json={
+            "nome_completo": f"Cliente {i}",
+            "telefone": "11999999999",
+            "data_consulta": "2030-05-17",
+            "horario": "20:00",
+        })
+
+    responses = await asyncio.gather(*(book(i) for i in range(BOOKINGS)))
+
+    statuses = [r.status_code for r in responses]
+    assert statuses.count(200) == 1
+    assert statuses.count(400) == BOOKINGS - 1
+    assert {r.json()["detail"] for r in responses if r.status_code == 400} == {"Horário já ocupado"}
+    assert await server.db.consultas.count_documents({"data_consulta": "2030-05-17"}) == 1
+
+
+async def test_existing_double_bookings_are_released(server):
+    for i in range(3):
+        consulta = server.ConsultaAgendamento(
+            nome_completo=f"Cliente {i}", telefone="11999999999", data_consulta="2030-05-18", horario="20:00"
+        )
+        await server.db.consultas.insert_one({k: v for k, v in consulta.dict().items() if k != "ocupa_horario"})
+
+    await server.run_migration_once("consultas_ocupa_horario", server.backfill_consulta_slots)
+    await server.run_migration_once("consultas_slot_duplicates", server.release_duplicate_slots)
+
+    holders = [c["nome_completo"] async for c in server.db.consultas.find({"ocupa_horario": True})]
+    assert holders == ["Cliente 0"]
+    # Released bookings stay on the admin list for rescheduling
+    assert await server.db.consultas.count_documents({"status": "agendado"}) == 3
+
+
+async def test_startup_fails_without_the_slot_index(server, monkeypatch):
+    monkeypatch.setattr(server, "index_build_failures", {})
+    for i in range(2):
+        await server.db.consultas.insert_one({
+            "id": f"dup-{i}", "data_consulta": "2030-05-18", "horario": "20:00", "status": "agendado", "ocupa_horario": True,
+        })
+
+    with pytest.raises(RuntimeError, match="slot_unique_active"):
+        await server.ensure_indexes_stage()
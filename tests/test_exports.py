@@ -0,0 +1,90 @@
+import csv
+import io
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from tests.conftest import ADMIN_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+INITIATED_AT = datetime(2030, 5, 17, 14, 0, tzinfo=timezone.utc)
+
+
+async def seed_export_rows(server):
+    transaction = server.PaymentTransaction(
+        session_id="cs_export",
+        service_type="amor",
+        amount=297.0,
+        payment_status=server.PaymentStatus.INITIATED,
+        status_timestamps={"initiated": INITIATED_AT},
+        created_at=INITIATED_AT,
+        updated_at=INITIATED_AT,
+    )
+    await server.db.payment_transactions.insert_one(transaction.dict())
+    form = server.ClientForm(
+        payment_session_id="cs_export",
+        nome_completo="Cliente, \"Exportação\"",
+        data_nascimento="1990-01-01",
+        telefone="11999999999",
+        situacao_atual="teste",
+        service_type="amor",
+        video_links=["https://video.test/1", "https://video.test/2"],
+    )
+    await server.db.client_forms.insert_one(form.dict())
+
+
+async def test_csv_export(server, api):
+    await seed_export_rows(server)
+
+    transactions = await api.get("/api/admin/export/transactions?format=csv", headers=ADMIN_HEADERS)
+    clients = await api.get("/api/admin/export/clients?format=csv", headers=ADMIN_HEADERS)
+
+    assert transactions.headers["content-type"].startswith("text/csv")
+    assert 'filename="transactions-' in transactions.headers["content-disposition"]
+    header, row = list(csv.reader(io.StringIO(transactions.text)))
+    assert header == server.EXPORTS["transactions"][1]
+    exported = dict(zip(header, row))
+    assert exported["session_id"] == "cs_export"
+    assert exported["payment_status"] == "initiated"
+    assert json.loads(exported["status_timestamps"]) == {"initiated": INITIATED_AT.isoformat()}
+
+    header, row = list(csv.reader(io.StringIO(clients.text)))
+    exported = dict(zip(header, row))
+    assert exported["nome_completo"] == 'Cliente, "Exportação"'
+    assert json.loads(exported["video_links"]) == ["https://video.test/1", "https://video.test/2"]
+    assert exported["observacoes"] == ""
+
+
+async def test_ndjson_export(server, api):
+    await seed_export_rows(server)
+
+    transactions = await api.get("/api/admin/export/transactions", headers=ADMIN_HEADERS)
+    clients = await api.get("/api/admin/export/clients?format=ndjson", headers=ADMIN_HEADERS)
+
+    assert transactions.headers["content-type"].startswith("application/x-ndjson")
+    [transaction] = [json.loads(line) for line in transactions.text.splitlines()]
+    assert set(transaction) <= set(server.EXPORTS["transactions"][1])
+    assert transaction["status_timestamps"] == {"initiated": INITIATED_AT.isoformat()}
+    assert transaction["created_at"] == INITIATED_AT.isoformat()
+
+    [client] = [json.loads(line) for line in clients.text.splitlines()]
+    assert client["video_links"] == ["https://video.test/1", "https://video.test/2"]
+    assert "_id" not in client
+
+
+@pytest.mark.parametrize("export_format", ["csv", "ndjson"])
+async def test_empty_export(api, export_format):
+    response = await api.get(f"/api/admin/export/consultas?format={export_format}", headers=ADMIN_HEADERS)
+
+    assert response.status_code == 200
+    if export_format == "csv":
+        assert list(csv.reader(io.StringIO(response.text))) == [["id", "nome_completo", "telefone", "data_consulta", "horario", "valor", "status", "observacoes", "created_at"]]
+    else:
+        assert response.text == ""
+
+
+async def test_export_requires_admin_and_known_collection(api):
+    assert (await api.get("/api/admin/export/transactions")).status_code == 401
+    assert (await api.get("/api/admin/export/webhook_inbox", headers=ADMIN_HEADERS)).status_code == 404
@@ -0,0 +1,40 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from tests.conftest import ADMIN_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+
+def flyer(titulo):
+    return {"titulo": titulo, "descricao": f"Descrição {titulo}"}
+
+
+async def test_active_flyer_etag_and_invalidation(server, api):
+    empty = await api.get("/api/flyer-ativo")
+    assert empty.json() == {"flyer": None}
+    not_modified = await api.get("/api/flyer-ativo", headers={"If-None-Match": empty.headers["etag"]})
+    assert not_modified.status_code == 304
+
+    await api.post("/api/admin/flyer", json=flyer("Primeiro"), headers=ADMIN_HEADERS)
+    first = await api.get("/api/flyer-ativo")
+    assert first.json()["flyer"]["titulo"] == "Primeiro"
+    assert first.headers["etag"] != empty.headers["etag"]
+
+    await api.post("/api/admin/flyer", json=flyer("Segundo"), headers=ADMIN_HEADERS)
+    second = await api.get("/api/flyer-ativo", headers={"If-None-Match": first.headers["etag"]})
+    assert second.status_code == 200
+    assert second.json()["flyer"]["titulo"] == "Segundo"
+    assert await server.db.flyers.count_documents({"ativo": True}) == 1
+
+
+async def test_create_never_retires_a_newer_flyer(server, api):
+    # A concurrent create that inserted a newer flyer before this one retires
+    newer = server.FlyerContent(**flyer("Mais novo"), created_at=datetime.now(timezone.utc) + timedelta(seconds=1))
+    await server.db.flyers.insert_one(newer.dict())
+
+    await api.post("/api/admin/flyer", json=flyer("Mais antigo"), headers=ADMIN_HEADERS)
+
+    assert (await server.db.flyers.find_one({"id": newer.id}))["ativo"] is True
+    assert (await api.get("/api/flyer-ativo")).json()["flyer"]["titulo"] == "Mais novo"
@@ -0,0 +1,36 @@
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_metrics_exposes_route_templates(server, api):
+    await api.get("/api/checkout/status/cs_missing")
+    await api.get("/api/does-not-exist")
+
+    response = await api.get("/metrics")
+
+    assert response.status_code == 200
+    assert 'route="/api/checkout/status/{session_id}"' in response.text
+    assert 'http_requests_total{method="GET",route="unmatched",status="404"}' in response.text
+    assert "cs_missing" not in response.text
+
+
+async def test_mongo_pool_stats(server, api, monkeypatch):
+    from pymongo import monitoring
+
+    from metrics import MetricsRegistry, MongoPoolMetrics
+
+    registry = MetricsRegistry()
+    pool = MongoPoolMetrics(registry)
+    monkeypatch.setattr(server, "mongo_pool_metrics", pool)
+    address = ("db.internal", 27017)
+    for connection_id in (1, 2):
+        pool.connection_created(monitoring.ConnectionCreatedEvent(address, connection_id))
+    pool.connection_check_out_started(monitoring.ConnectionCheckOutStartedEvent(address))
+    pool.connection_checked_out(monitoring.ConnectionCheckedOutEvent(address, 1))
+
+    response = await api.get("/api/admin/mongo-pool", headers={"Authorization": "Bearer admin_authenticated"})
+
+    assert response.json()["pools"] == {"db.internal:27017": {"open": 2, "in_use": 1, "waiting": 0}}
+    assert 'mongodb_pool_connections{address="db.internal:27017"} 2' in registry.render()
+    assert (await api.get("/api/admin/mongo-pool")).status_code == 401
@@ -0,0 +1,109 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+pytestmark = pytest.mark.anyio
+
+
+async def seed_duplicate_rituais(server):
+    for copy in range(3):
+        await server.db.rituais.insert_one({"id": "amor", "name": f"Ritual de Amor {copy}", "active": True})
+    await server.db.rituais.insert_one({"id": "protecao", "name": "Ritual de Proteção", "active": True})
+
+
+async def test_unique_index_failure_is_reported_without_dropping_siblings(server, monkeypatch):
+    monkeypatch.setattr(server, "index_build_failures", {})
+    await seed_duplicate_rituais(server)
+
+    failures = await server.ensure_indexes()
+
+    assert [(f["collection"], f["name"]) for f in failures] == [("rituais", "id_unique")]
+    assert ("rituais", "id_unique") in server.index_build_failures
+    assert {"active", "created_at_id"} <= set(await server.db.rituais.index_information())
+
+
+async def test_rituais_dedupe_keeps_the_first_copy_before_indexing(server, monkeypatch):
+    monkeypatch.setattr(server, "index_build_failures", {})
+    await seed_duplicate_rituais(server)
+
+    assert await server.run_migration_once("rituais_dedupe", server.dedupe_rituais)
+    failures = await server.ensure_indexes()
+
+    assert failures == []
+    assert [r["name"] async for r in server.db.rituais.find({"id": "amor"})] == ["Ritual de Amor 0"]
+    assert await server.db.rituais.count_documents({}) == 2
+    assert "id_unique" in await server.db.rituais.index_information()
+
+
+def counting_migration(runs, delay=0):
+    async def migration():
+        runs.append(1)
+        await asyncio.sleep(delay)
+    return migration
+
+
+async def test_concurrent_workers_run_a_migration_once(server, monkeypatch):
+    monkeypatch.setattr(server, "MIGRATION_POLL_SECONDS", 0.01)
+    runs = []
+
+    results = await asyncio.gather(*(
+        server.run_migration_once("seed", counting_migration(runs, delay=0.05)) for _ in range(3)
+    ))
+
+    assert runs == [1]
+    assert sorted(results) == [False, False, True]
+    assert await server.db.migrations.find_one({"_id": "seed", "status": "done"})
+    assert await server.db.migrations.find_one({"_id": "seed:lock"}) is None
+    assert not await server.run_migration_once("seed", counting_migration(runs))
+
+
+async def test_live_lock_makes_other_workers_wait_without_running(server, monkeypatch):
+    monkeypatch.setattr(server, "MIGRATION_WAIT_SECONDS", 0.05)
+    monkeypatch.setattr(server, "MIGRATION_POLL_SECONDS", 0.01)
+    await server.db.migrations.insert_one({"_id": "seed:lock", "owner": "alive", "locked_at": datetime.now(timezone.utc)})
+    runs = []
+
+    assert not await server.run_migration_once("seed", counting_migration(runs))
+
+    assert runs == []
+    assert (await server.db.migrations.find_one({"_id": "seed:lock"}))["owner"] == "alive"
+
+
+async def test_stale_lock_is_taken_over(server):
+    locked_at = datetime.now(timezone.utc) - server.MIGRATION_LOCK_TIMEOUT - timedelta(minutes=1)
+    await server.db.migrations.insert_one({"_id": "seed:lock", "owner": "crashed", "locked_at": locked_at})
+    runs = []
+
+    assert await server.run_migration_once("seed", counting_migration(runs))
+
+    assert runs == [1]
+    assert await server.db.migrations.find_one({"_id": "seed", "status": "done"})
+    assert await server.db.migrations.find_one({"_id": "seed:lock"}) is None
+
+
+async def test_overrunning_holder_keeps_the_new_owners_lock(server):
+    async def overrun():
+        # Another worker takes the lock over while this one is still running
+        await server.db.migrations.update_one({"_id": "seed:lock"}, {"$set": {"owner": "successor"}})
+
+    assert await server.run_migration_once("seed", overrun)
+
+    assert (await server.db.migrations.find_one({"_id": "seed:lock"}))["owner"] == "successor"
+
+
+async def test_startup_stages_report_timings_and_results(server, monkeypatch):
+    async def quiet():
+        await asyncio.sleep(0.01)
+
+    async def reporting():
+        return {"released": 2}
+
+    monkeypatch.setattr(server, "startup_stages", [("quiet", quiet), ("reporting", reporting)])
+
+    report = await server.run_startup_stages()
+
+    assert list(report["stages_ms"]) == ["quiet", "reporting"]
+    assert report["stages_ms"]["quiet"] >= 10
+    assert report["results"] == {"reporting": {"released": 2}}
+    assert report["total_ms"] >= report["stages_ms"]["quiet"]
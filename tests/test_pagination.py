@@ -0,0 +1,36 @@
+import pytest
+
+from tests.conftest import ADMIN_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_admin_consultas_pages_cover_every_row_once(server, api):
+    for i in range(7):
+        consulta = server.ConsultaAgendamento(
+            nome_completo=f"Cliente {i}",
+            telefone="11999999999",
+            data_consulta=f"2030-01-0{i % 3 + 1}",
+            horario=f"14:{i * 5:02d}",
+        )
+        await server.db.consultas.insert_one(consulta.dict())
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        response = await api.get("/api/admin/consultas", headers=ADMIN_HEADERS, params=params)
+        assert response.status_code == 200
+        body = response.json()
+        assert len(body["consultas"]) <= 3
+        seen += [(c["data_consulta"], c["horario"]) for c in body["consultas"]]
+        cursor = body["next_cursor"]
+        if cursor is None:
+            break
+
+    assert len(seen) == 7
+    assert seen == sorted(seen)
+
+
+async def test_admin_list_rejects_malformed_cursor(api):
+    response = await api.get("/api/admin/flyers", headers=ADMIN_HEADERS, params={"cursor": "nope"})
+    assert response.status_code == 400
@@ -0,0 +1,44 @@
+import pytest
+
+from tests.conftest import ADMIN_HEADERS, assert_query_budget
+from tests.test_admin_clients import seed_clients
+
+pytestmark = pytest.mark.anyio
+
+# (path, admin, max Mongo commands) with 40 clients/transactions seeded;
+# every budget is independent of row count
+ENDPOINT_BUDGETS = [
+    ("/api/services", False, 1),
+    ("/api/flyer-ativo", False, 1),
+    ("/api/horarios-disponiveis/2030-01-01", False, 1),
+    ("/api/horarios-disponiveis?from=2030-01-01&to=2030-01-31", False, 1),
+    ("/api/admin/clients", True, 3),
+    ("/api/admin/transactions", True, 2),
+    ("/api/admin/consultas", True, 1),
+    ("/api/admin/rituais", True, 1),
+    ("/api/admin/flyers", True, 1),
+    ("/api/admin/stats", True, 1),
+]
+
+
+@pytest.mark.parametrize("path,admin,max_mongo", ENDPOINT_BUDGETS)
+async def test_endpoint_stays_within_query_budget(server, api, path, admin, max_mongo):
+    await seed_clients(server, 40)
+
+    response = await api.get(path, headers=ADMIN_HEADERS if admin else {})
+
+    assert response.status_code == 200
+    assert_query_budget(response, max_mongo)
+
+
+async def test_checkout_status_budget(server, api):
+    created = await api.post(
+        "/api/checkout/session",
+        json={"service_type": "amor", "origin_url": "http://test"},
+        headers={"Idempotency-Key": "budget"},
+    )
+    # ritual lookup and transaction insert, plus claiming and filling the idempotency key
+    assert_query_budget(created, max_mongo=4, max_stripe=1)
+
+    status = await api.get(f"/api/checkout/status/{created.json()['session_id']}")
+    assert_query_budget(status, max_mongo=2, max_stripe=1)
@@ -0,0 +1,105 @@
+import os
+import uuid
+
+import pytest
+
+from tests.conftest import ADMIN_HEADERS
+from tests.test_admin_clients import seed_clients
+
+pytestmark = pytest.mark.anyio
+
+REPORTING_ROUTES = ["/api/admin/clients", "/api/admin/transactions", "/api/admin/consultas", "/api/admin/export/transactions"]
+
+
+@pytest.fixture
+def routed_reads(server, monkeypatch):
+    """Record the read preference mode of every collection the app touches;
+    db.<name> and db[<name>] go through get_collection with the default
+    (primary) preference, so unrouted reads show up too"""
+    reads = []
+    get_collection = server.db.get_collection
+
+    def spy(name, **options):
+        preference = options.get("read_preference")
+        reads.append((name, preference.mongos_mode if preference else "primary"))
+        return get_collection(name, **options)
+
+    monkeypatch.setattr(server.db, "get_collection", spy, raising=False)
+    return reads
+
+
+def test_reporting_policy_bounds_staleness(server):
+    preference = server.READ_POLICIES["reporting"]
+    assert preference.mongos_mode == "secondaryPreferred"
+    assert preference.max_staleness >= 90
+    assert server.READ_POLICIES["primary"].mongos_mode == "primary"
+
+
+@pytest.mark.parametrize("path", REPORTING_ROUTES)
+async def test_reporting_routes_read_from_secondaries(server, api, routed_reads, path):
+    await seed_clients(server, 3)
+    routed_reads.clear()
+
+    response = await api.get(path, headers=ADMIN_HEADERS)
+
+    assert response.status_code == 200
+    assert routed_reads and {mode for _, mode in routed_reads} == {"secondaryPreferred"}
+
+
+async def test_checkout_reads_stay_on_primary(server, api, stripe_stub, routed_reads):
+    created = await api.post("/api/checkout/session", json={"service_type": "amor", "origin_url": "http://test"})
+    stripe_stub.complete(created.json()["session_id"])
+    await api.get(f"/api/checkout/status/{created.json()['session_id']}")
+    await api.get(f"/api/checkout/status/{created.json()['session_id']}")
+
+    assert ("payment_transactions", "primary") in routed_reads
+    assert {mode for _, mode in routed_reads} == {"primary"}
+
+
+async def test_read_policies_against_replica_set(server, api, stripe_stub, monkeypatch):
+    """Run with MONGO_REPLICA_SET_URL pointing at a local replica set, e.g.
+    mongodb://localhost:27017/?replicaSet=rs0, to check what the driver sends"""
+    url = os.environ.get("MONGO_REPLICA_SET_URL")
+    if not url:
+        pytest.skip("MONGO_REPLICA_SET_URL not set")
+    from motor.motor_asyncio import AsyncIOMotorClient
+    from pymongo import monitoring
+
+    class ReadPreferences(monitoring.CommandListener):
+        def __init__(self):
+            self.commands = []
+
+        def started(self, event):
+            if event.command_name in ("find", "aggregate"):
+                collection = event.command.get(event.command_name)
+                mode = event.command.get("$readPreference", {}).get("mode", "primary")
+                self.commands.append((collection, mode, event.connection_id))
+
+        def succeeded(self, event):
+            pass
+
+        def failed(self, event):
+            pass
+
+    listener = ReadPreferences()
+    client = AsyncIOMotorClient(url, event_listeners=[listener])
+    name = f"test_read_routing_{uuid.uuid4().hex[:8]}"
+    monkeypatch.setattr(server, "db", client[name])
+    try:
+        created = await api.post("/api/checkout/session", json={"service_type": "amor", "origin_url": "http://test"})
+        session_id = created.json()["session_id"]
+        await api.get(f"/api/checkout/status/{session_id}")
+        checkout_reads = [c for c in listener.commands if c[0] == "payment_transactions"]
+        listener.commands.clear()
+
+        await api.get("/api/admin/transactions", headers=ADMIN_HEADERS)
+
+        assert checkout_reads and {mode for _, mode, _ in checkout_reads} == {"primary"}
+        assert {mode for _, mode, _ in listener.commands} == {"secondaryPreferred"}
+        hello = await client.admin.command("hello")
+        if len(hello.get("hosts", [])) > 1:
+            host, port = hello["primary"].rsplit(":", 1)
+            assert (host, int(port)) not in {address for _, _, address in listener.commands}
+    finally:
+        await client.drop_database(name)
+        client.close()
@@ -0,0 +1,55 @@
+import pytest
+
+from tests.conftest import ADMIN_HEADERS
+
+pytestmark = pytest.mark.anyio
+
+
+async def book(api, data_consulta, horario):
+    response = await api.post("/api/consulta/agendar", json={
+        "nome_completo": "Cliente", "telefone": "11999999999", "data_consulta": data_consulta, "horario": horario,
+    })
+    assert response.status_code == 200
+    return response.json()
+
+
+async def test_range_follows_bookings_and_status_changes(server, api):
+    url = "/api/horarios-disponiveis?from=2030-05-17&to=2030-05-19"
+    first = (await api.get(url)).json()
+    assert list(first["horarios_disponiveis"]) == ["2030-05-17", "2030-05-18", "2030-05-19"]
+    assert first["horarios_disponiveis"]["2030-05-18"] == server.SLOT_TEMPLATE
+
+    booked = await book(api, "2030-05-18", "20:00")
+    after_booking = (await api.get(url)).json()["horarios_disponiveis"]
+    assert "20:00" not in after_booking["2030-05-18"]
+    assert after_booking["2030-05-17"] == server.SLOT_TEMPLATE
+    assert "20:00" not in (await api.get("/api/horarios-disponiveis/2030-05-18")).json()["horarios_disponiveis"]
+
+    consulta_id = booked["consulta_id"]
+    response = await api.put(f"/api/admin/consulta/{consulta_id}/status?status=cancelado", headers=ADMIN_HEADERS)
+    assert response.status_code == 200
+    assert (await api.get(url)).json()["horarios_disponiveis"]["2030-05-18"] == server.SLOT_TEMPLATE
+
+
+@pytest.mark.parametrize("path", [
+    "/api/horarios-disponiveis/amanha",
+    "/api/horarios-disponiveis/2030-02-30",
+    "/api/horarios-disponiveis?from=2030-05-17&to=ontem",
+    "/api/horarios-disponiveis?from=2030-05-19&to=2030-05-17",
+    "/api/horarios-disponiveis?from=2030-01-01&to=2030-12-31",
+])
+async def test_invalid_dates_are_rejected(server, api, path):
+    response = await api.get(path)
+
+    assert response.status_code == 400
+    assert server.slot_cache._bitmaps == {}
+
+
+async def test_slot_cache_is_bounded(server):
+    cache = server.SlotOccupancyCache(ttl_seconds=60, max_entries=10)
+
+    for month in range(1, 13):
+        await cache.get_many([f"2030-{month:02d}-{day:02d}" for day in range(1, 6)])
+
+    assert len(cache._bitmaps) == 10
+    assert "2030-12-05" in cache._bitmaps